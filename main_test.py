@@ -1,17 +1,23 @@
 # main_test.py
 import asyncio
+import sys
 import time
 import os
-import json # 用于设置模拟LLM响应
-import sqlite3 # 用于直接查询验证
 import logging
+from pathlib import Path
+
+try:
+    import uvloop # 可选：存在时用 uvloop 替换默认事件循环，跨线程唤醒更快
+    uvloop.install()
+except ImportError:
+    pass
 
 # 导入修改后的管理器和数据库处理器
 from profile.profile_db import ProfileDB 
 from profile.profile_manager import ProfileManager
 from profile.sobriquet.sobriquet_manager import SobriquetManager
 
-from typing import Dict, List, Optional, Any, Tuple 
+from typing import Dict, List, Optional, Any, Tuple, NamedTuple
 # 导入模拟依赖
 from stubs.mock_config import global_config
 from stubs.mock_dependencies import (
@@ -19,31 +25,86 @@ from stubs.mock_dependencies import (
     person_info_manager as mock_person_info_manager, 
     relationship_manager as mock_relationship_manager, 
     set_mock_llm_response, 
+    dumps_json,
     MockChatStream,
     MockMessageRecv,
 )
 
 logger = get_logger("MainTest")
 
-chat_streams_history: Dict[str, MockChatStream] = {}
+# 绰号场景中的用户 ID 与对应的模拟 LLM 响应；响应内容在编写测试时就已确定，导入时序列化一次
+SOB_USER_ID1 = "sob_user_1"
+SOB_USER_ID2 = "sob_user_2"
+MOCK_RESP_LAOZHANG = dumps_json({"is_exist": True, "data": {SOB_USER_ID1: "老张"}}) # LLM 返回的是 platform_user_id
+MOCK_RESP_LAOLI = dumps_json({"is_exist": True, "data": {SOB_USER_ID2: "老李"}})
+
+
+class SobriquetScene(NamedTuple):
+    """一个绰号场景：群聊中新增的消息（最后一条作为锚点）、Bot 回复，以及期望 LLM 为目标用户映射出的绰号。"""
+    label: str
+    messages: Tuple[Tuple[str, str], ...] # (user_id, text)
+    bot_reply: str # 同时作为模拟响应的 identifier（Bot 回复会原样出现在 prompt 中）
+    target_user_id: str
+    sobriquet: str
+    response: str # 预先序列化好的模拟 LLM 响应
+
+
+SOBRIQUET_SCENES: Tuple[SobriquetScene, ...] = (
+    SobriquetScene(
+        "场景1",
+        ((SOB_USER_ID1, "大家好，我是张三！"), (SOB_USER_ID2, f"你好张三，我是李四。听说 {SOB_USER_ID1} 也叫“老张”？")),
+        "明白了，李四。我会记住“老张”这个称呼的。", SOB_USER_ID1, "老张", MOCK_RESP_LAOZHANG,
+    ),
+    SobriquetScene(
+        "场景2",
+        ((SOB_USER_ID1, f"对了，{SOB_USER_ID2}，大家都叫你“老李”吗？"),),
+        "好的，张三。", SOB_USER_ID2, "老李", MOCK_RESP_LAOLI,
+    ),
+)
 
 
-async def run_sobriquet_test_scenario(profile_db_instance: ProfileDB, profile_manager_instance: ProfileManager):
-    logger.info("开始绰号功能测试场景...")
-    # chat_streams_history 在外部定义并传入，或者在这里管理也可以
-    # 为了隔离，这里的 chat_streams_history 可以是局部的，或者确保清理
-    
-    # SobriquetManager 依赖 chat_streams_history
-    # 注意：如果 chat_streams_history 是全局的，确保它在不同测试场景间得到正确管理或重置
-    current_test_chat_streams_history: Dict[str, MockChatStream] = {}
+class TestRig(NamedTuple):
+    """各测试场景共享的组件，由 build_test_rig 构建一次后传入各场景。"""
+    profile_db: ProfileDB
+    profile_manager: ProfileManager
+    sobriquet_manager: Optional[SobriquetManager]
+    chat_streams_history: Dict[str, MockChatStream]
 
 
-    sobriquet_manager_instance = SobriquetManager(
-        db_handler=profile_db_instance, 
-        profile_manager_instance=profile_manager_instance,
-        chat_history_provider=current_test_chat_streams_history # 使用当前测试场景的聊天记录
-    )
-    logger.info("SobriquetManager (SQLite, MockLLM) 初始化完成。")
+def build_test_rig(db_file: str, with_sobriquet_manager: bool = True) -> TestRig:
+    # 同时删除 WAL 模式留下的 -wal/-shm 文件，避免上次异常退出的残留数据被重新载入
+    for stale_file in (db_file, f"{db_file}-wal", f"{db_file}-shm"):
+        Path(stale_file).unlink(missing_ok=True)
+    logger.info("已清理旧的数据库文件: %s", db_file)
+
+    profile_db_instance = ProfileDB(db_path=db_file) 
+    logger.info("ProfileDB (SQLite) 初始化完成，数据库文件: %s", profile_db_instance.db_path)
+
+    profile_manager_instance = ProfileManager(profile_db_instance=profile_db_instance) 
+    logger.info("ProfileManager (SQLite) 初始化完成。")
+
+    # SobriquetManager 通过 chat_history_provider 读取聊天记录，各场景向同一个字典中注册自己的聊天流。
+    # SobriquetManager 是单例，只应绑定到一个 rig 的数据库上。
+    chat_streams_history: Dict[str, MockChatStream] = {}
+    sobriquet_manager_instance = None
+    if with_sobriquet_manager:
+        sobriquet_manager_instance = SobriquetManager(
+            db_handler=profile_db_instance, 
+            profile_manager_instance=profile_manager_instance,
+            chat_history_provider=chat_streams_history
+        )
+        logger.info("SobriquetManager (SQLite, MockLLM) 初始化完成。")
+    return TestRig(profile_db_instance, profile_manager_instance, sobriquet_manager_instance, chat_streams_history)
+
+
+async def verify_sobriquet_present(profile_db: ProfileDB, npid: str, group_key: str, expected_name: str) -> bool:
+    """只查询该用户在该群组下这一个绰号的次数，判断绰号是否已被记录。"""
+    return await profile_db.get_sobriquet_count(npid, group_key, expected_name) > 0
+
+
+async def run_sobriquet_test_scenario(rig: TestRig):
+    logger.info("开始绰号功能测试场景...")
+    profile_db_instance, profile_manager_instance, sobriquet_manager_instance, current_test_chat_streams_history = rig
     
     sobriquet_manager_instance.start_processor()
     logger.info("SobriquetManager 处理器已启动。")
@@ -51,199 +112,192 @@ async def run_sobriquet_test_scenario(profile_db_instance: ProfileDB, profile_ma
     platform = "test_platform_sobriquet" # 使用不同的平台以避免与其他测试冲突
     group_id1 = "group_sob_101"
     group_id2 = "group_sob_102" 
-    user_id1 = "sob_user_1" 
-    user_id2 = "sob_user_2" 
+    user_id1 = SOB_USER_ID1
+    user_id2 = SOB_USER_ID2
     user_id3 = "sob_user_bot" # Bot
 
-    # 为模拟依赖准备数据
-    mock_person_info_manager.add_mock_user(platform, user_id1, "pid_sob_user_1") 
+    # 为模拟依赖准备数据；add_mock_user 直接返回 person_info_pid，无需再查表
+    pid_by_user: Dict[str, str] = {}
+    pid_by_user[user_id1] = mock_person_info_manager.add_mock_user(platform, user_id1, "pid_sob_user_1") 
     mock_relationship_manager.add_mock_user_name(platform, user_id1, "张三")
 
-    mock_person_info_manager.add_mock_user(platform, user_id2, "pid_sob_user_2")
+    pid_by_user[user_id2] = mock_person_info_manager.add_mock_user(platform, user_id2, "pid_sob_user_2")
     mock_relationship_manager.add_mock_user_name(platform, user_id2, "李四")
     
-    mock_person_info_manager.add_mock_user(platform, user_id3, "pid_sob_bot_user") 
+    pid_by_user[user_id3] = mock_person_info_manager.add_mock_user(platform, user_id3, "pid_sob_bot_user") 
     mock_relationship_manager.add_mock_user_name(platform, user_id3, global_config.bot.nickname) 
 
-    pid_user1 = mock_person_info_manager.get_person_id(platform, user_id1)
-    npid_user1 = profile_manager_instance.generate_profile_document_id(pid_user1) if pid_user1 else None
+    # 一次性算出各用户的 NaturalPersonID，后续直接查表
+    doc_ids: Dict[str, str] = {
+        uid: profile_manager_instance.generate_profile_document_id(pid) for uid, pid in pid_by_user.items()
+    }
 
-    pid_user2 = mock_person_info_manager.get_person_id(platform, user_id2)
-    npid_user2 = profile_manager_instance.generate_profile_document_id(pid_user2) if pid_user2 else None
+    # 群聊流 ID 与数据库中 sobriquets_by_group 的键格式相同（"平台-群号"），只构建一次并复用
+    stream_key_g1 = sys.intern(f"{platform}-{group_id1}")
+    stream_key_g2 = sys.intern(f"{platform}-{group_id2}")
+    chat_stream1 = MockChatStream(stream_key_g1, platform, group_id1)
+    current_test_chat_streams_history[stream_key_g1] = chat_stream1
+    logger.debug("SobriquetTest: Populated chat_streams_history with key '%s'.", stream_key_g1)
+
+    # 绰号注入所用的上下文消息模板，只构建一次；每次调用时浅拷贝并刷新时间戳
+    injection_context_template = (
+        {"user_info": {"user_id": user_id1}, "message_content": "大家好，我是张三！", "time": 0.0},
+        {"user_info": {"user_id": user_id2}, "message_content": "你好张三，我是李四。", "time": 0.0},
+    )
 
-    stream_id1 = f"{platform}-{group_id1}"
-    chat_stream1 = MockChatStream(stream_id1, platform, group_id1)
-    current_test_chat_streams_history[stream_id1] = chat_stream1
-    logger.debug(f"SobriquetTest: Populated chat_streams_history with key '{stream_id1}'.")
+    # 锚点消息按 (聊天流, 用户) 复用，每次只更新文本与时间戳
+    anchor_messages: Dict[Tuple[str, str], MockMessageRecv] = {}
+
+    def _anchor_message(stream: MockChatStream, uid: str, text: str) -> MockMessageRecv:
+        msg = anchor_messages.get((stream.stream_id, uid))
+        if msg is None:
+            msg = anchor_messages[(stream.stream_id, uid)] = MockMessageRecv(stream, uid, text)
+            return msg
+        return msg.bind(text)
+
+    def _injection_context() -> List[Dict[str, Any]]:
+        now = time.time()
+        return [{**injection_context_template[0], "time": now - 10}, {**injection_context_template[1], "time": now - 5}]
+
+    # 显式指定递增的时间戳来保证消息顺序，无需用 sleep 拉开 time.time() 的间隔。
+    # 基准时间取在过去，保证这些消息都早于触发分析时的 time.time()，能被历史记录查询到。
+    t0 = time.time() - 60
+
+    # 为 user_id2 (李四) 预置另一个群组的绰号，以测试 all_known_sobriquets_summary
+    # apply_sobriquet_writes 在同一个事务内确保文档与平台账户存在并写入绰号
+    await profile_db_instance.apply_sobriquet_writes([
+        (doc_ids[user_id2], pid_by_user[user_id2], platform, user_id2, group_id2, "李哥", 1),
+    ])
+    logger.info("为 NPID %s 在群组 %s 添加了初始绰号 '李哥'", doc_ids[user_id2], group_id2)
+
+    # 各场景涉及不同的画像文档和不同的模拟 LLM 响应，可以并发触发；
+    # SobriquetManager 的后台处理线程会按入队顺序写库。
+    # 模拟响应以各场景独有的 Bot 回复作为 identifier，
+    # 避免并发时各场景的 prompt 命中对方的响应（prompt 中都包含所有用户的 user_id）。
+    async def _run_scene(scene: SobriquetScene, start_timestamp: float):
+        logger.info("-" * 30 + " 开始%s: %s ('%s') " + "-" * 30, scene.label, scene.target_user_id, scene.sobriquet)
+        added_messages = chat_stream1.add_messages(list(scene.messages), start_timestamp=start_timestamp)
+        anchor = added_messages[-1]
+        anchor_uid = anchor["user_info"]["user_id"]
+        # 模拟 MessageRecv 对象，它能从 chat_stream 中获取 platform, group_id 等信息
+        anchor_msg = _anchor_message(chat_stream1, anchor_uid, anchor["message_content"])
+
+        set_mock_llm_response(identifier=scene.bot_reply, response=scene.response)
+        logger.info("为用户 %s 设置了模拟 LLM 响应 (identifier: '%s'), 期望绰号 '%s'", scene.target_user_id, scene.bot_reply, scene.sobriquet)
+
+        logger.info("触发对用户 %s 消息的绰号分析 (%s: 关于 %s 的绰号)...", anchor_uid, scene.label, scene.target_user_id)
+        await sobriquet_manager_instance.trigger_sobriquet_analysis(anchor_msg, [scene.bot_reply], chat_stream=chat_stream1)
+
+    # 各场景的消息按顺序占用连续的时间戳（间隔 1 秒）
+    scene_start_timestamps: List[float] = []
+    next_timestamp = t0
+    for scene in SOBRIQUET_SCENES:
+        scene_start_timestamps.append(next_timestamp)
+        next_timestamp += len(scene.messages)
+    await asyncio.gather(*(_run_scene(scene, ts) for scene, ts in zip(SOBRIQUET_SCENES, scene_start_timestamps)))
+
+    logger.info("等待后台绰号处理 (%s)...", " + ".join(scene.label for scene in SOBRIQUET_SCENES))
+    if not await sobriquet_manager_instance.wait_until_idle(timeout=5):
+        logger.error("失败: 等待后台绰号处理完成超时。")
+
+    # 两个场景的写入都已完成：以下读取互不依赖，在同一个 TaskGroup 中并发发出，再依次验证
+    expected_sobriquets = [
+        (scene.label, scene.target_user_id, doc_ids[scene.target_user_id], scene.sobriquet) for scene in SOBRIQUET_SCENES
+    ]
+    # 两个场景都在群组1中，一次导出 user1 + user2 的画像，分别用于两个场景的验证
+    platform_user_id_to_npid_map = {user_id1: doc_ids[user_id1], user_id2: doc_ids[user_id2]}
+    async with asyncio.TaskGroup() as tg:
+        present_tasks = [
+            tg.create_task(verify_sobriquet_present(profile_db_instance, npid, stream_key_g1, expected_name))
+            for _scene, _uid, npid, expected_name in expected_sobriquets
+        ]
+        lige_g2_task = tg.create_task(verify_sobriquet_present(profile_db_instance, doc_ids[user_id2], stream_key_g2, "李哥"))
+        lige_g1_task = tg.create_task(verify_sobriquet_present(profile_db_instance, doc_ids[user_id2], stream_key_g1, "李哥"))
+        injection_task = tg.create_task(sobriquet_manager_instance.get_sobriquet_prompt_injection(chat_stream1, _injection_context()))
+        prompt_export_task = tg.create_task(profile_manager_instance.get_profile_data_for_prompt(
+            natural_person_ids_in_context=[doc_ids[user_id1], doc_ids[user_id2]],
+            current_platform=platform,
+            platform_user_id_to_npid_map=platform_user_id_to_npid_map,
+            current_group_id=group_id1
+        ))
+    injection_str = injection_task.result()
+    prompt_export_data = prompt_export_task.result()
+
+    logger.info("验证数据库中的绰号 (%s)...", ", ".join(f"{scene.label}: {scene.sobriquet}" for scene in SOBRIQUET_SCENES))
+    for (scene, uid, npid, expected_name), present_task in zip(expected_sobriquets, present_tasks):
+        if present_task.result():
+            logger.info("成功 (%s): 在数据库中为用户 %s (NPID: %s) 在群组 %s 找到了绰号 '%s'。", scene, uid, npid, group_id1, expected_name)
+        else:
+            logger.error("失败 (%s): 未在数据库中为用户 %s (NPID: %s) 在群组 %s 找到绰号 '%s'。", scene, uid, npid, group_id1, expected_name)
 
-    chat_stream1.add_message(user_id1, "大家好，我是张三！")
-    await asyncio.sleep(0.01) 
-    chat_stream1.add_message(user_id2, f"你好张三，我是李四。听说 {user_id1} 也叫“老张”？") 
-    await asyncio.sleep(0.01)
-    
-    bot_reply_text = [f"明白了，李四。我会记住“老张”这个称呼的。"]
-    # 模拟 MessageRecv 对象
-    # 假设 MockMessageRecv 的构造函数是 (chat_stream, user_id, text_content)
-    # 并且它能从 chat_stream 中获取 platform, group_id 等信息
-    # 或者，如果 trigger_sobriquet_analysis 需要更完整的 MessageRecv 对象，
-    # 我们可能需要更细致地模拟它或调整 trigger_sobriquet_analysis 的接口
-    anchor_msg_user2 = MockMessageRecv(chat_stream1, user_id2, chat_stream1.messages[-1]['message_content'])
-
-
-    llm_response_for_user1_laozhang = {
-        "is_exist": True,
-        "data": {
-            user_id1: "老张" # LLM返回的是 platform_user_id
-        }
-    }
-    # 使用一个独特的标识符来设置模拟响应，这个标识符应该能在LLM的prompt中被找到
-    # 在当前的 sobriquet_mapper.py 中，prompt 会包含聊天记录中的 user_id
-    # 所以，我们可以用目标用户的 user_id 作为 set_mock_llm_response 的 identifier
-    set_mock_llm_response(identifier=user_id1, response_json_string=json.dumps(llm_response_for_user1_laozhang))
-    logger.info(f"为用户 {user_id1} 设置了模拟 LLM 响应 (identifier: '{user_id1}'), 期望绰号 '老张'")
-
-    logger.info(f"触发对用户 {user_id2} 消息的绰号分析...")
-    await sobriquet_manager_instance.trigger_sobriquet_analysis(anchor_msg_user2, bot_reply_text, chat_stream=chat_stream1)
-    
-    logger.info("等待后台绰号处理 (场景1, 3秒)...") 
-    await asyncio.sleep(3) 
-
-    logger.info("验证数据库中的绰号 (场景1: 老张)...")
-    if npid_user1:
-        profile_doc_user1_after_scene1 = await profile_db_instance.get_profile_document(npid_user1)
-        if profile_doc_user1_after_scene1 and profile_doc_user1_after_scene1.get("sobriquets_by_group"):
-            sobriquets_data = profile_doc_user1_after_scene1["sobriquets_by_group"]
-            group_key = f"{platform}-{group_id1}"
-            user1_group_sobriquets = sobriquets_data.get(group_key, {}).get("sobriquets", [])
-            found_laozhang = any(s.get("name") == "老张" and s.get("count", 0) > 0 for s in user1_group_sobriquets)
-            if found_laozhang:
-                logger.info(f"成功 (场景1): 在数据库中为用户 {user_id1} (NPID: {npid_user1}) 找到了绰号 '老张'。数据: {user1_group_sobriquets}")
-            else:
-                logger.error(f"失败 (场景1): 未在数据库中为用户 {user_id1} (NPID: {npid_user1}) 找到绰号 '老张'。数据库数据: {user1_group_sobriquets}")
-                logger.debug(f"完整文档 (场景1 User1): {profile_doc_user1_after_scene1}")
+    # 场景2预置的 '李哥' 应只记录在群组2下，不应混入群组1
+    if lige_g2_task.result() and not lige_g1_task.result():
+        logger.info("成功 (场景2): '李哥' 只记录在群组 %s 下。", group_id2)
+    else:
+        logger.error("失败 (场景2): '李哥' 的群组归属不正确。群组2 中存在: %s, 群组1 中存在: %s", lige_g2_task.result(), lige_g1_task.result())
 
+    # 两个场景写入后的绰号注入，验证两个场景的绰号都能被注入 Prompt
+    for scene in SOBRIQUET_SCENES:
+        if f"“{scene.sobriquet}”" in injection_str:
+            logger.info("成功 (%s 绰号注入): 注入字符串包含 '%s'。", scene.label, scene.sobriquet)
         else:
-            logger.error(f"失败 (场景1): 未在数据库中找到用户 {user_id1} (NPID: {npid_user1}) 的绰号数据。文档: {profile_doc_user1_after_scene1}")
-    else:
-        logger.error(f"失败 (场景1): 无法获取用户 {user_id1} 的 NaturalPersonID。")
-
-    logger.info("-" * 30 + " 测试 get_profile_data_for_prompt (场景1后) " + "-" * 30)
-    if npid_user1:
-        # 构建 platform_user_id 到 npid 的映射，仅包含当前上下文中的用户
-        platform_user_id_to_npid_map_scene1 = {user_id1: npid_user1}
-        prompt_export_data_scene1 = await profile_manager_instance.get_profile_data_for_prompt(
-            natural_person_ids_in_context=[npid_user1], # 只导出 user1 的画像
-            current_platform=platform,
-            platform_user_id_to_npid_map=platform_user_id_to_npid_map_scene1,
-            current_group_id=group_id1
-        )
-        logger.debug(f"Prompt export data (场景1后) for NPID {npid_user1}: \n{json.dumps(prompt_export_data_scene1.get(npid_user1), indent=2, ensure_ascii=False)}")
+            logger.error("失败 (%s 绰号注入): 注入字符串未包含 '%s'。得到: %s", scene.label, scene.sobriquet, injection_str)
+
+    logger.info("-" * 30 + " 测试 get_profile_data_for_prompt (场景1: user1, 场景2: user2) " + "-" * 30)
+    if logger.isEnabledFor(logging.DEBUG): # dumps_json 的参数会被立即求值，非 DEBUG 时整体跳过
+        logger.debug("Prompt export data (场景1) for NPID %s: \n%s", doc_ids[user_id1], dumps_json(prompt_export_data.get(doc_ids[user_id1]), indent=True))
         
-        user1_exported_profile = prompt_export_data_scene1.get(npid_user1)
-        if user1_exported_profile:
-            ctx = user1_exported_profile.get("current_platform_context", {}).get(platform, {}).get(user_id1, {})
-            if ctx.get("group_nickname") == "老张" and ctx.get("platform_nickname") == "张三":
-                logger.info("成功 (Prompt Export): current_platform_context 验证通过 ('老张', '张三')。")
-            else:
-                logger.error(f"失败 (Prompt Export): current_platform_context 验证失败。得到: {ctx}")
-
-            summary = user1_exported_profile.get("all_known_sobriquets_summary", "")
-            if "老张" in summary: 
-                logger.info(f"成功 (Prompt Export): all_known_sobriquets_summary 包含 '老张'。摘要: {summary}")
-            else:
-                logger.error(f"失败 (Prompt Export): all_known_sobriquets_summary 未包含 '老张'。摘要: {summary}")
-            
-            # 检查 identity 和 personality 字段是否存在 (即使它们是空的)
-            if ("identity" in user1_exported_profile and 
-                "personality" in user1_exported_profile and
-                "impression" in user1_exported_profile): # impression 也是默认字段
-                 logger.info("成功 (Prompt Export): identity, personality, impression 字段存在。")
-            else:
-                 logger.error(f"失败 (Prompt Export): identity, personality, impression 字段部分或全部缺失。 Profile keys: {list(user1_exported_profile.keys())}")
+    user1_exported_profile = prompt_export_data.get(doc_ids[user_id1])
+    if user1_exported_profile:
+        ctx = user1_exported_profile.get("current_platform_context", {}).get(platform, {}).get(user_id1, {})
+        if ctx.get("group_nickname") == "老张" and ctx.get("platform_nickname") == "张三":
+            logger.info("成功 (Prompt Export): current_platform_context 验证通过 ('老张', '张三')。")
         else:
-            logger.error(f"失败 (Prompt Export): 未能为 NPID {npid_user1} 获取导出的画像数据。")
-
-
-    logger.info("-" * 30 + " 开始场景 2: 李四 ('老李') " + "-" * 30)
-    if npid_user2:
-        # 确保文档存在，并为 user_id2 (李四) 添加另一个群组的绰号，以测试 all_known_sobriquets_summary
-        # 注意：ensure_profile_document_exists 现在也处理平台账户
-        await profile_db_instance.ensure_profile_document_exists(npid_user2, pid_user2, platform, user_id2)
-        await profile_db_instance.update_group_sobriquet_count(npid_user2, platform, group_id2, "李哥") 
-        logger.info(f"为 NPID {npid_user2} 在群组 {group_id2} 添加了初始绰号 '李哥'")
-
-    chat_stream1.add_message(user_id1, f"对了，{user_id2}，大家都叫你“老李”吗？") 
-    await asyncio.sleep(0.01)
-    bot_reply_text_2 = ["好的，张三。"]
-    anchor_msg_user1_for_scene2 = MockMessageRecv(chat_stream1, user_id1, chat_stream1.messages[-1]['message_content'])
-
-    llm_response_for_user2_laoli = {
-        "is_exist": True,
-        "data": {
-            user_id2: "老李" 
-        }
-    }
-    set_mock_llm_response(identifier=user_id2, response_json_string=json.dumps(llm_response_for_user2_laoli))
-    logger.info(f"为用户 {user_id2} 设置了模拟 LLM 响应 (identifier: '{user_id2}'), 期望绰号 '老李'")
+            logger.error("失败 (Prompt Export): current_platform_context 验证失败。得到: %s", ctx)
 
-    logger.info(f"触发对用户 {user_id1} 消息的绰号分析 (场景2: 关于李四的绰号)...")
-    await sobriquet_manager_instance.trigger_sobriquet_analysis(anchor_msg_user1_for_scene2, bot_reply_text_2, chat_stream=chat_stream1)
-    
-    logger.info("等待后台绰号处理 (场景2, 3秒)...") 
-    await asyncio.sleep(3)
-
-    logger.info("验证数据库中的绰号 (场景2: 老李)...") 
-    if npid_user2:
-        profile_doc_user2_after_scene2 = await profile_db_instance.get_profile_document(npid_user2)
-        if profile_doc_user2_after_scene2 and profile_doc_user2_after_scene2.get("sobriquets_by_group"):
-            sobriquets_data_u2 = profile_doc_user2_after_scene2["sobriquets_by_group"]
-            group_key_scene2 = f"{platform}-{group_id1}" 
-            user2_group_sobriquets_scene2 = sobriquets_data_u2.get(group_key_scene2, {}).get("sobriquets", [])
-            found_laoli = any(s.get("name") == "老李" and s.get("count", 0) > 0 for s in user2_group_sobriquets_scene2)
-            if found_laoli:
-                logger.info(f"成功 (场景2): 在数据库中为用户 {user_id2} (NPID: {npid_user2}) 在群组 {group_id1} 找到了绰号 '老李'。")
-            else:
-                logger.error(f"失败 (场景2): 未在数据库中为用户 {user_id2} (NPID: {npid_user2}) 在群组 {group_id1} 找到绰号 '老李'。数据: {user2_group_sobriquets_scene2}")
+        summary = user1_exported_profile.get("all_known_sobriquets_summary", "")
+        if "老张" in summary: 
+            logger.info("成功 (Prompt Export): all_known_sobriquets_summary 包含 '老张'。摘要: %s", summary)
         else:
-            logger.error(f"失败 (场景2): 未在数据库中找到用户 {user_id2} (NPID: {npid_user2}) 的绰号数据。文档: {profile_doc_user2_after_scene2}")
+            logger.error("失败 (Prompt Export): all_known_sobriquets_summary 未包含 '老张'。摘要: %s", summary)
+            
+        # 检查 identity 和 personality 字段是否存在 (即使它们是空的)
+        if ("identity" in user1_exported_profile and 
+            "personality" in user1_exported_profile and
+            "impression" in user1_exported_profile): # impression 也是默认字段
+             logger.info("成功 (Prompt Export): identity, personality, impression 字段存在。")
+        else:
+             logger.error("失败 (Prompt Export): identity, personality, impression 字段部分或全部缺失。 Profile keys: %s", list(user1_exported_profile.keys()))
     else:
-        logger.error(f"失败 (场景2): 无法获取用户 {user_id2} 的 NaturalPersonID。")
+        logger.error("失败 (Prompt Export): 未能为 NPID %s 获取导出的画像数据。", doc_ids[user_id1])
+
+    user2_exported_profile = prompt_export_data.get(doc_ids[user_id2])
+    if user2_exported_profile:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Prompt export data (场景2) for NPID %s: \n%s", doc_ids[user_id2], dumps_json(user2_exported_profile, indent=True))
+        ctx_u2 = user2_exported_profile.get("current_platform_context", {}).get(platform, {}).get(user_id2, {})
+        if ctx_u2.get("group_nickname") == "老李" and ctx_u2.get("platform_nickname") == "李四": 
+            logger.info("成功 (Prompt Export - user2): current_platform_context 验证通过 ('老李', '李四')。")
+        else:
+            logger.error("失败 (Prompt Export - user2): current_platform_context 验证失败。得到: %s", ctx_u2)
 
-    logger.info("-" * 30 + " 测试 get_profile_data_for_prompt (场景2后) " + "-" * 30)
-    if npid_user1 and npid_user2:
-        platform_user_id_to_npid_map_scene2 = {user_id1: npid_user1, user_id2: npid_user2}
-        prompt_export_data_scene2 = await profile_manager_instance.get_profile_data_for_prompt(
-            natural_person_ids_in_context=[npid_user1, npid_user2], 
-            current_platform=platform,
-            platform_user_id_to_npid_map=platform_user_id_to_npid_map_scene2,
-            current_group_id=group_id1 
-        )
-        
-        user2_exported_profile = prompt_export_data_scene2.get(npid_user2)
-        if user2_exported_profile:
-            logger.debug(f"Prompt export data (场景2后) for NPID {npid_user2}: \n{json.dumps(user2_exported_profile, indent=2, ensure_ascii=False)}")
-            ctx_u2 = user2_exported_profile.get("current_platform_context", {}).get(platform, {}).get(user_id2, {})
-            if ctx_u2.get("group_nickname") == "老李" and ctx_u2.get("platform_nickname") == "李四": 
-                logger.info("成功 (Prompt Export - user2): current_platform_context 验证通过 ('老李', '李四')。")
-            else:
-                logger.error(f"失败 (Prompt Export - user2): current_platform_context 验证失败。得到: {ctx_u2}")
-
-            summary_u2 = user2_exported_profile.get("all_known_sobriquets_summary", "")
-            if "老李" in summary_u2 and "李哥" not in summary_u2: 
-                logger.info(f"成功 (Prompt Export - user2): all_known_sobriquets_summary 验证通过 (只含 '老李')。摘要: {summary_u2}")
-            else:
-                logger.error(f"失败 (Prompt Export - user2): all_known_sobriquets_summary 验证失败。应只含 '老李'，不含 '李哥'。摘要: {summary_u2}")
+        summary_u2 = user2_exported_profile.get("all_known_sobriquets_summary", "")
+        if "老李" in summary_u2 and "李哥" not in summary_u2: 
+            logger.info("成功 (Prompt Export - user2): all_known_sobriquets_summary 验证通过 (只含 '老李')。摘要: %s", summary_u2)
         else:
-            logger.error(f"失败 (Prompt Export - user2): 未能为 NPID {npid_user2} 获取导出的画像数据。")
+            logger.error("失败 (Prompt Export - user2): all_known_sobriquets_summary 验证失败。应只含 '老李'，不含 '李哥'。摘要: %s", summary_u2)
+    else:
+        logger.error("失败 (Prompt Export - user2): 未能为 NPID %s 获取导出的画像数据。", doc_ids[user_id2])
 
     logger.info("停止 SobriquetManager 处理器...")
-    sobriquet_manager_instance.stop_processor() 
-    await asyncio.sleep(0.1) 
+    # stop_processor() 内部会 join 处理器线程，放到执行器中运行以免阻塞事件循环
+    await asyncio.get_running_loop().run_in_executor(None, sobriquet_manager_instance.stop_processor)
     logger.info("绰号功能测试场景结束。")
 
 
-async def run_platform_accounts_test_scenario(profile_db_instance: ProfileDB, profile_manager_instance: ProfileManager):
+async def run_platform_accounts_test_scenario(rig: TestRig):
     logger.info("=" * 30 + " 开始 Platform Accounts 测试场景 " + "=" * 30)
+    profile_db_instance, profile_manager_instance = rig.profile_db, rig.profile_manager
 
     # 定义测试用户和平台
     # 用户A (pid_pa_A) -> npid_A
@@ -257,97 +311,114 @@ async def run_platform_accounts_test_scenario(profile_db_instance: ProfileDB, pr
     #   - platform_Y, user_C_py1
     #   - platform_X, user_C_px2 (同一平台不同账号，但应关联到 pid_pa_C)
 
-    # 模拟 person_info_manager 返回的 PID
-    mock_person_info_manager.add_mock_user("platform_X", "user_A_px1", "pid_pa_A")
-    mock_person_info_manager.add_mock_user("platform_Y", "user_A_py1", "pid_pa_A")
+    # (平台, 平台账号, person_info_pid)，同一份数据既用于模拟 person_info_manager，也用于写入账户信息
+    USERS: Tuple[Tuple[str, str, str], ...] = (
+        ("platform_X", "user_A_px1", "pid_pa_A"),
+        ("platform_Y", "user_A_py1", "pid_pa_A"),
+        ("platform_X", "user_A_px1", "pid_pa_A"), # 重复添加，测试唯一性约束或逻辑
+        ("platform_X", "user_B_px1", "pid_pa_B"),
+        ("platform_Z", "user_B_pz1", "pid_pa_B"),
+        ("platform_X", "user_C_px1", "pid_pa_C"),
+        ("platform_Y", "user_C_py1", "pid_pa_C"),
+        ("platform_X", "user_C_px2", "pid_pa_C"), # 关键：user_C_px2 也关联到 pid_pa_C
+    )
 
-    mock_person_info_manager.add_mock_user("platform_X", "user_B_px1", "pid_pa_B")
-    mock_person_info_manager.add_mock_user("platform_Z", "user_B_pz1", "pid_pa_B")
-    
-    mock_person_info_manager.add_mock_user("platform_X", "user_C_px1", "pid_pa_C")
-    mock_person_info_manager.add_mock_user("platform_Y", "user_C_py1", "pid_pa_C")
-    mock_person_info_manager.add_mock_user("platform_X", "user_C_px2", "pid_pa_C") # 关键：user_C_px2 也关联到 pid_pa_C
+    # 模拟 person_info_manager 返回的 PID
+    for user_platform, user_uid, user_pid in USERS:
+        mock_person_info_manager.add_mock_user(user_platform, user_uid, user_pid)
 
     # 生成 NPID
     npid_A = profile_manager_instance.generate_profile_document_id("pid_pa_A")
     npid_B = profile_manager_instance.generate_profile_document_id("pid_pa_B")
     npid_C = profile_manager_instance.generate_profile_document_id("pid_pa_C")
 
-    logger.info(f"NPID_A: {npid_A}, NPID_B: {npid_B}, NPID_C: {npid_C}")
+    logger.info("NPID_A: %s, NPID_B: %s, NPID_C: %s", npid_A, npid_B, npid_C)
 
-    # 1. 添加账户信息
-    await profile_db_instance.ensure_profile_document_exists(npid_A, "pid_pa_A", "platform_X", "user_A_px1")
-    await profile_db_instance.ensure_profile_document_exists(npid_A, "pid_pa_A", "platform_Y", "user_A_py1")
-    # 重复添加，测试唯一性约束或逻辑
-    await profile_db_instance.ensure_profile_document_exists(npid_A, "pid_pa_A", "platform_X", "user_A_px1") 
+    # 1. 添加账户信息（一个事务内批量写入）
+    await profile_db_instance.ensure_profile_documents_exist_bulk([
+        (profile_manager_instance.generate_profile_document_id(user_pid), user_pid, user_platform, user_uid)
+        for user_platform, user_uid, user_pid in USERS
+    ])
 
-    await profile_db_instance.ensure_profile_document_exists(npid_B, "pid_pa_B", "platform_X", "user_B_px1")
-    await profile_db_instance.ensure_profile_document_exists(npid_B, "pid_pa_B", "platform_Z", "user_B_pz1")
 
-    await profile_db_instance.ensure_profile_document_exists(npid_C, "pid_pa_C", "platform_X", "user_C_px1")
-    await profile_db_instance.ensure_profile_document_exists(npid_C, "pid_pa_C", "platform_Y", "user_C_py1")
-    await profile_db_instance.ensure_profile_document_exists(npid_C, "pid_pa_C", "platform_X", "user_C_px2")
-
-
-    # 2. 验证 platform_accounts
+    # 2. 验证 platform_accounts（一次 IN 查询取回三个用户的文档）
+    docs_by_npid = await profile_db_instance.get_profile_documents([npid_A, npid_B, npid_C])
     logger.info("--- 验证用户A的账户信息 ---")
-    doc_A = await profile_db_instance.get_profile_document(npid_A)
+    doc_A = docs_by_npid.get(npid_A)
     if doc_A and "platform_accounts" in doc_A:
         expected_A = {"platform_X": ["user_A_px1"], "platform_Y": ["user_A_py1"]}
-        # 对列表进行排序以确保比较的稳定性
+        # 实际结果的列表顺序不保证，排序后比较；预期值本身已按字母序书写
         accounts_A = {k: sorted(v) for k, v in doc_A["platform_accounts"].items()}
-        expected_A_sorted = {k: sorted(v) for k, v in expected_A.items()}
-        if accounts_A == expected_A_sorted:
-            logger.info(f"成功 (用户A): platform_accounts 匹配预期。得到: {accounts_A}")
+        if accounts_A == expected_A:
+            logger.info("成功 (用户A): platform_accounts 匹配预期。得到: %s", accounts_A)
         else:
-            logger.error(f"失败 (用户A): platform_accounts 不匹配。预期: {expected_A_sorted}, 得到: {accounts_A}")
+            logger.error("失败 (用户A): platform_accounts 不匹配。预期: %s, 得到: %s", expected_A, accounts_A)
     else:
-        logger.error(f"失败 (用户A): 未找到文档或 platform_accounts 字段。文档: {doc_A}")
+        logger.error("失败 (用户A): 未找到文档或 platform_accounts 字段。文档: %s", doc_A)
 
     logger.info("--- 验证用户B的账户信息 ---")
-    doc_B = await profile_db_instance.get_profile_document(npid_B)
+    doc_B = docs_by_npid.get(npid_B)
     if doc_B and "platform_accounts" in doc_B:
         expected_B = {"platform_X": ["user_B_px1"], "platform_Z": ["user_B_pz1"]}
         accounts_B = {k: sorted(v) for k, v in doc_B["platform_accounts"].items()}
-        expected_B_sorted = {k: sorted(v) for k, v in expected_B.items()}
-        if accounts_B == expected_B_sorted:
-            logger.info(f"成功 (用户B): platform_accounts 匹配预期。得到: {accounts_B}")
+        if accounts_B == expected_B:
+            logger.info("成功 (用户B): platform_accounts 匹配预期。得到: %s", accounts_B)
         else:
-            logger.error(f"失败 (用户B): platform_accounts 不匹配。预期: {expected_B_sorted}, 得到: {accounts_B}")
+            logger.error("失败 (用户B): platform_accounts 不匹配。预期: %s, 得到: %s", expected_B, accounts_B)
     else:
-        logger.error(f"失败 (用户B): 未找到文档或 platform_accounts 字段。文档: {doc_B}")
+        logger.error("失败 (用户B): 未找到文档或 platform_accounts 字段。文档: %s", doc_B)
 
     logger.info("--- 验证用户C的账户信息 (同人多平台多账号) ---")
-    doc_C = await profile_db_instance.get_profile_document(npid_C)
+    doc_C = docs_by_npid.get(npid_C)
     if doc_C and "platform_accounts" in doc_C:
         expected_C = {"platform_X": ["user_C_px1", "user_C_px2"], "platform_Y": ["user_C_py1"]}
         accounts_C = {k: sorted(v) for k, v in doc_C["platform_accounts"].items()}
-        expected_C_sorted = {k: sorted(v) for k, v in expected_C.items()}
-        if accounts_C == expected_C_sorted:
-            logger.info(f"成功 (用户C): platform_accounts 匹配预期。得到: {accounts_C}")
+        if accounts_C == expected_C:
+            logger.info("成功 (用户C): platform_accounts 匹配预期。得到: %s", accounts_C)
         else:
-            logger.error(f"失败 (用户C): platform_accounts 不匹配。预期: {expected_C_sorted}, 得到: {accounts_C}")
+            logger.error("失败 (用户C): platform_accounts 不匹配。预期: %s, 得到: %s", expected_C, accounts_C)
     else:
-        logger.error(f"失败 (用户C): 未找到文档或 platform_accounts 字段。文档: {doc_C}")
+        logger.error("失败 (用户C): 未找到文档或 platform_accounts 字段。文档: %s", doc_C)
 
     # 3. 测试 get_profile_document 只请求 platform_accounts
     logger.info("--- 测试 get_profile_document fields=['platform_accounts'] (用户A) ---")
     doc_A_only_pa = await profile_db_instance.get_profile_document(npid_A, fields=["platform_accounts", "_id"]) # _id 会被自动加入
     if doc_A_only_pa and "platform_accounts" in doc_A_only_pa and "_id" in doc_A_only_pa:
         if len(doc_A_only_pa.keys()) == 2: # 应该只有 platform_accounts 和 _id
-             logger.info(f"成功 (用户A fields): 只返回了 platform_accounts 和 _id。 Keys: {list(doc_A_only_pa.keys())}")
+             logger.info("成功 (用户A fields): 只返回了 platform_accounts 和 _id。 Keys: %s", list(doc_A_only_pa.keys()))
         else:
-            logger.error(f"失败 (用户A fields): 返回了多余的字段。 Keys: {list(doc_A_only_pa.keys())}")
+            logger.error("失败 (用户A fields): 返回了多余的字段。 Keys: %s", list(doc_A_only_pa.keys()))
         
         expected_A = {"platform_X": ["user_A_px1"], "platform_Y": ["user_A_py1"]}
         accounts_A_pa_only = {k: sorted(v) for k, v in doc_A_only_pa["platform_accounts"].items()}
-        expected_A_sorted_pa_only = {k: sorted(v) for k, v in expected_A.items()}
-        if accounts_A_pa_only == expected_A_sorted_pa_only:
-            logger.info(f"成功 (用户A fields): platform_accounts 内容匹配。")
+        if accounts_A_pa_only == expected_A:
+            logger.info("成功 (用户A fields): platform_accounts 内容匹配。")
         else:
-            logger.error(f"失败 (用户A fields): platform_accounts 内容不匹配。预期: {expected_A_sorted_pa_only}, 得到: {accounts_A_pa_only}")
+            logger.error("失败 (用户A fields): platform_accounts 内容不匹配。预期: %s, 得到: %s", expected_A, accounts_A_pa_only)
+    else:
+        logger.error("失败 (用户A fields): 使用 fields 参数获取 platform_accounts 失败。文档: %s", doc_A_only_pa)
+
+    # 4. 测试 ensure_and_get_profile_document：添加账户并在同一事务内读回文档
+    logger.info("--- 测试 ensure_and_get_profile_document (用户A 新增 platform_W 账户) ---")
+    doc_A_ensured = await profile_db_instance.ensure_and_get_profile_document(npid_A, "pid_pa_A", "platform_W", "user_A_pw1")
+    expected_A_ensured = {"platform_W": ["user_A_pw1"], "platform_X": ["user_A_px1"], "platform_Y": ["user_A_py1"]}
+    accounts_A_ensured = {k: sorted(v) for k, v in (doc_A_ensured or {}).get("platform_accounts", {}).items()}
+    if accounts_A_ensured == expected_A_ensured:
+        logger.info("成功 (用户A ensure_and_get): 返回的文档包含新账户。得到: %s", accounts_A_ensured)
+    else:
+        logger.error("失败 (用户A ensure_and_get): platform_accounts 不匹配。预期: %s, 得到: %s", expected_A_ensured, accounts_A_ensured)
+
+    # 5. 测试整体替换 sobriquets_by_group 时，同一群组内重复的绰号合并为一条并累加次数
+    logger.info("--- 测试 update_profile_fields 替换 sobriquets_by_group (用户B 重复绰号) ---")
+    replaced = await profile_db_instance.update_profile_fields(npid_B, {"sobriquets_by_group": {
+        "platform_X-grp1": {"sobriquets": [{"name": "a", "count": 2}, {"name": "b", "count": 1}, {"name": "a", "count": 3}]}
+    }})
+    sobriquets_B = await profile_db_instance.get_profile_field(npid_B, "sobriquets_by_group")
+    expected_sobriquets_B = {"platform_X-grp1": {"sobriquets": [{"name": "a", "count": 5}, {"name": "b", "count": 1}]}}
+    if replaced and sobriquets_B == expected_sobriquets_B:
+        logger.info("成功 (用户B sobriquets_by_group): 重复绰号的次数已合并。得到: %s", sobriquets_B)
     else:
-        logger.error(f"失败 (用户A fields): 使用 fields 参数获取 platform_accounts 失败。文档: {doc_A_only_pa}")
+        logger.error("失败 (用户B sobriquets_by_group): 预期: %s, 得到: %s (返回值 %s)", expected_sobriquets_B, sobriquets_B, replaced)
 
 
     logger.info("=" * 30 + " Platform Accounts 测试场景结束 " + "=" * 30)
@@ -356,27 +427,51 @@ async def run_platform_accounts_test_scenario(profile_db_instance: ProfileDB, pr
 async def run_all_tests():
     logger.info("开始所有测试...")
     
-    db_file = global_config.profile.db_path
-    if os.path.exists(db_file):
-        logger.info(f"删除旧的数据库文件: {db_file}")
-        os.remove(db_file)
+    # 两个场景互不共享数据，各自使用独立的数据库文件并发运行，避免争用同一个 SQLite 写锁
+    db_base, db_ext = os.path.splitext(global_config.profile.db_path)
+    sobriquet_rig = build_test_rig(f"{db_base}_sobriquet{db_ext}")
+    platform_accounts_rig = build_test_rig(f"{db_base}_platform_accounts{db_ext}", with_sobriquet_manager=False)
+    rigs = (sobriquet_rig, platform_accounts_rig)
+
+    # WAL、synchronous=NORMAL 等设置已由 ProfileDB 在建立连接时应用
+    for rig in rigs:
+        await rig.profile_db.connect() # 同一 rig 内的 ProfileDB、ProfileManager 与 SobriquetManager 共用这一条写连接（读操作走只读连接池）
+
+    await asyncio.gather(
+        run_sobriquet_test_scenario(sobriquet_rig),
+        run_platform_accounts_test_scenario(platform_accounts_rig),
+    )
 
-    profile_db_instance = ProfileDB(db_path=db_file) 
-    logger.info(f"ProfileDB (SQLite) 初始化完成，数据库文件: {profile_db_instance.db_path}")
+    for rig in rigs:
+        await rig.profile_db.close()
+    logger.info("所有测试场景结束。")
 
-    profile_manager_instance = ProfileManager(profile_db_instance=profile_db_instance) 
-    logger.info("ProfileManager (SQLite) 初始化完成。")
 
-    # 运行绰号测试
-    await run_sobriquet_test_scenario(profile_db_instance, profile_manager_instance)
+# 需要在重新执行时保留的 sys.flags 属性及其命令行选项
+_PASSTHROUGH_FLAGS = (
+    ("ignore_environment", "-E"), ("no_user_site", "-s"), ("no_site", "-S"), ("dont_write_bytecode", "-B"),
+    ("isolated", "-I"), ("safe_path", "-P"), ("verbose", "-v"), ("bytes_warning", "-b"), ("quiet", "-q"),
+)
 
-    # 运行 platform_accounts 测试
-    await run_platform_accounts_test_scenario(profile_db_instance, profile_manager_instance)
-    
-    logger.info("所有测试场景结束。")
+
+def _current_interpreter_options() -> List[str]:
+    """由 sys.flags、sys.warnoptions 与 sys._xoptions 还原当前解释器的命令行选项。"""
+    options = [option for name, option in _PASSTHROUGH_FLAGS for _ in range(int(getattr(sys.flags, name, 0)))]
+    options += [f"-W{warning}" for warning in sys.warnoptions]
+    options += [f"-X{key}" if value is True else f"-X{key}={value}" for key, value in sys._xoptions.items()]
+    return options
 
 
 if __name__ == "__main__":
+    # 可选：设置 PROFILE_TEST_OPTIMIZED=1 时以 -O（跳过 assert）和固定的 PYTHONHASHSEED 重新执行自身，
+    # 减少解释器开销并使 dict/set 迭代顺序可复现。保留当前的解释器选项（-X、-W 等）和用户已设置的 PYTHONHASHSEED
+    if os.environ.get("PROFILE_TEST_OPTIMIZED") == "1" and (sys.flags.optimize == 0 or "PYTHONHASHSEED" not in os.environ):
+        interpreter_flags = _current_interpreter_options()
+        if sys.flags.optimize == 0:
+            interpreter_flags.append("-O")
+        os.execve(sys.executable, [sys.executable, *interpreter_flags, os.path.abspath(__file__)] + sys.argv[1:],
+                  {"PYTHONHASHSEED": "0", **os.environ})
+
     logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     logging.getLogger("asyncio").setLevel(logging.INFO) # asyncio 日志级别调高，避免过多无关输出
     
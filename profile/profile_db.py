@@ -3,72 +3,406 @@ import sqlite3
 import json
 import threading
 import asyncio
-from typing import Optional, List, Dict, Any
+import concurrent.futures
+import contextlib
+import copy
+import functools
+import queue
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Tuple, AsyncIterator
 import datetime
 
+try:
+    import orjson # 可选：C 实现的 JSON 解析/序列化，缺失时回退到标准库 json
+except ImportError:
+    orjson = None
+
 # 从 stubs 导入
 from stubs.mock_dependencies import get_logger 
 
 logger = get_logger("ProfileDB_SQLite")
 
+# JSON 字段的序列化/解析。orjson 生成的 bytes 直接绑定为 BLOB 存储，读取时原样交给 orjson.loads，
+# 省去一次 UTF-8 解码/编码（列声明的 TEXT 亲和性不会转换 BLOB 值；这些列不再经过 JSON1 函数处理）。
+# 没有 orjson 时以 str 存为 TEXT；两种存储读取时都能解析，已有数据无需迁移。
+# orjson.JSONDecodeError 是 json.JSONDecodeError 的子类，调用方统一捕获 json.JSONDecodeError 即可。
+if orjson is not None:
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    _loads = orjson.loads
+else:
+    _dumps = json.dumps
+    _loads = json.loads
+
+# 空 JSON 列的值在模块加载时序列化一次，新建文档时直接复用
+_EMPTY_OBJ = _dumps({})
+_EMPTY_ARR = _dumps([])
+
+
+def _dump_column_value(value: Any) -> Any:
+    """dict/list 序列化为 JSON（空容器直接使用预先序列化的常量），其它值原样返回。"""
+    if isinstance(value, dict):
+        return _dumps(value) if value else _EMPTY_OBJ
+    if isinstance(value, list):
+        return _dumps(value) if value else _EMPTY_ARR
+    return value
+
+# 每个新连接建立后执行的 PRAGMA。
+# journal_mode=WAL 是持久化到数据库文件的设置，只需在建表时执行一次（见 _create_tables_if_not_exists）。
+# busy 等待由 sqlite3.connect(timeout=...) 负责，这里不再重复设置 busy_timeout。
+# analysis_limit 限制 ANALYZE / PRAGMA optimize 每个索引扫描的行数，使统计信息的收集在大库上也只需毫秒级。
+_CONNECTION_PRAGMAS = """
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-65536;
+PRAGMA mmap_size=268435456;
+PRAGMA analysis_limit=400;
+"""
+
+# 只读连接池的大小（同时进行的读操作数上限）
+_READ_POOL_SIZE = 4
+
+# 每个连接缓存的已编译语句数。连接长期复用，批量 IN 查询又会按 id 数量产生不同的 SQL 文本，
+# 默认的 128 条容易被挤出，放大后常用语句都能命中缓存，免去重复的解析与查询规划
+_STATEMENT_CACHE_SIZE = 256
+
+# 批量 IN 查询每次绑定的 id 数上限，低于 SQLite 默认的绑定参数上限
+_IN_QUERY_CHUNK_SIZE = 500
+
+# profile_info 表结构，{table} 为表名（迁移旧表时先建在临时表名下）。
+# WITHOUT ROWID：行直接按 _id 组织在主键 B 树中，按 _id 查询只需一次 B 树查找，不必先查 _id 索引再回表
+_PROFILE_INFO_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {table} (
+    _id TEXT PRIMARY KEY,
+    person_info_pid_ref TEXT,
+    -- platform_accounts TEXT, -- 已移除，改为关系存储
+    identity TEXT,
+    personality TEXT,
+    sobriquets_by_group TEXT,
+    impression TEXT,
+    relationship_metrics TEXT,
+    creation_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+    last_updated_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+) WITHOUT ROWID
+"""
+_PROFILE_INFO_COLUMNS = ("_id, person_info_pid_ref, identity, personality, sobriquets_by_group, "
+                         "impression, relationship_metrics, creation_timestamp, last_updated_timestamp")
+# 完整的建表脚本，由 _create_tables_if_not_exists 通过 executescript 一次执行。
+# 所有索引都来自 PRIMARY KEY / UNIQUE 约束（写入时必须维护以保证唯一性），没有可推迟到批量导入之后再建的二级索引。
+_SCHEMA_SQL = _PROFILE_INFO_SCHEMA.format(table="profile_info") + """;
+
+-- platform_user_accounts：profile_info 中移除的 platform_accounts 字段改为关系存储
+CREATE TABLE IF NOT EXISTS platform_user_accounts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    profile_document_id TEXT NOT NULL,
+    platform_name TEXT NOT NULL,
+    platform_user_id TEXT NOT NULL,
+    FOREIGN KEY (profile_document_id) REFERENCES profile_info(_id) ON DELETE CASCADE,
+    UNIQUE (profile_document_id, platform_name, platform_user_id) -- 确保唯一性
+);
+
+-- 群组绰号计数按 (文档, 群组, 绰号) 一行存储，计数加一只需一条 UPSERT，不再改写整个 sobriquets_by_group JSON。
+-- 保留普通 rowid 表：rowid 记录绰号首次出现的顺序，读取时按 rowid 排序，与原 JSON 列表中的顺序一致。
+CREATE TABLE IF NOT EXISTS sobriquet_counts (
+    profile_id TEXT NOT NULL,
+    group_key TEXT NOT NULL,
+    name TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (profile_id) REFERENCES profile_info(_id) ON DELETE CASCADE,
+    PRIMARY KEY (profile_id, group_key, name)
+);
+"""
+# 多处复用的固定 SQL。文本不变，每条连接的语句缓存只需编译一次
+_INSERT_DOCUMENT_SQL = """
+INSERT OR IGNORE INTO profile_info (
+    _id, person_info_pid_ref, identity, personality,
+    sobriquets_by_group, impression, relationship_metrics
+) VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+_INSERT_ACCOUNT_SQL = """
+INSERT OR IGNORE INTO platform_user_accounts (profile_document_id, platform_name, platform_user_id)
+VALUES (?, ?, ?)
+"""
+_TOUCH_DOCUMENT_SQL = "UPDATE profile_info SET last_updated_timestamp = CURRENT_TIMESTAMP WHERE _id = ?"
+_SELECT_SOBRIQUET_COUNT_SQL = "SELECT count FROM sobriquet_counts WHERE profile_id = ? AND group_key = ? AND name = ?"
+_INSERT_SOBRIQUET_COUNT_SQL = "INSERT OR IGNORE INTO sobriquet_counts (profile_id, group_key, name, count) VALUES (?, ?, ?, ?)"
+# 把 count 加到 (profile_id, group_key, name) 对应的行上，行不存在时插入
+_UPSERT_SOBRIQUET_COUNT_SQL = """
+INSERT INTO sobriquet_counts (profile_id, group_key, name, count) VALUES (?, ?, ?, ?)
+ON CONFLICT (profile_id, group_key, name) DO UPDATE SET count = count + excluded.count
+"""
+# fields 投影允许选取的 profile_info 列（白名单），字段名只有通过它才会拼入 SQL
+_PROFILE_INFO_FIELDS = frozenset(column.strip() for column in _PROFILE_INFO_COLUMNS.split(","))
+
+
+# 随文档一起读取的关联数据：相关子查询把每个文档的平台账户 / 绰号计数聚合为一个 JSON 数组，
+# 一个文档仍只对应一行（不像 JOIN 那样按账户数重复整行 JSON），一次查询即可取回完整文档
+_ACCOUNTS_SUBQUERY = """(SELECT json_group_array(json_array(platform_name, platform_user_id))
+    FROM platform_user_accounts WHERE profile_document_id = profile_info._id) AS _accounts"""
+_SOBRIQUETS_SUBQUERY = """(SELECT json_group_array(json_array(group_key, name, count))
+    FROM (SELECT group_key, name, count FROM sobriquet_counts WHERE profile_id = profile_info._id ORDER BY rowid)) AS _sobriquets"""
+
+
+@functools.lru_cache(maxsize=64)
+def _select_documents_sql(columns: Tuple[str, ...], id_count: int, with_accounts: bool, with_sobriquets: bool) -> str:
+    """按 (列, IN 参数个数, 关联数据) 生成并缓存 SELECT 语句。同一投影总是得到相同的 SQL 文本，连接的语句缓存才能命中。"""
+    select_list = list(columns)
+    if with_accounts:
+        select_list.append(_ACCOUNTS_SUBQUERY)
+    if with_sobriquets:
+        select_list.append(_SOBRIQUETS_SUBQUERY)
+    return f"SELECT {', '.join(select_list)} FROM profile_info WHERE _id IN ({','.join('?' * id_count)})"
+
+
+# 以 TEXT 存储、读取时需要解析的 JSON 列（sobriquets_by_group 由 sobriquet_counts 表重建，不在此列）
+_JSON_FIELD_NAMES = ("identity", "personality", "impression", "relationship_metrics")
+# 单字段读取的预生成 SQL（列名来自白名单，不拼接调用方输入）；sobriquets_by_group 由 sobriquet_counts 表重建，不读旧列
+_SELECT_ONE_SQL = {
+    field_name: f"SELECT {field_name} FROM profile_info WHERE _id = ?"
+    for field_name in _PROFILE_INFO_FIELDS if field_name != "sobriquets_by_group"
+}
+
+# update_profile_fields 可更新的字段（platform_accounts 不再通过它更新）
+_UPDATABLE_FIELDS = ("person_info_pid_ref", "identity", "personality",
+                     "sobriquets_by_group", "impression", "relationship_metrics")
+# 单字段更新的预生成 SQL；sobriquets_by_group 写入 sobriquet_counts 表，走 update_profile_fields
+_UPDATE_ONE_SQL = {
+    field_name: f"UPDATE profile_info SET {field_name} = ?, last_updated_timestamp = CURRENT_TIMESTAMP WHERE _id = ?"
+    for field_name in _UPDATABLE_FIELDS if field_name != "sobriquets_by_group"
+}
+
+
+class _RawJSON:
+    """文档缓存中尚未解析的 JSON 列原始值（str 或 bytes）；投影时首次用到才解析，并把结果写回缓存的文档。"""
+    __slots__ = ("raw",)
+
+    def __init__(self, raw):
+        self.raw = raw
+
+# 进程内缓存的已解析文档数上限
+_DOCUMENT_CACHE_SIZE = 4096
+
+
+class _DocumentCache:
+    """
+    已解析 profile_info 完整文档的进程内 LRU 缓存，以 profile_document_id 为键。
+    写操作通过 invalidate 使对应文档失效；每次失效都会推进 generation，
+    读取开始前记下的 generation 已过期时不再回填，避免与并发写入交错后缓存旧文档。
+    """
+
+    def __init__(self, max_entries: int = _DOCUMENT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+
+    def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            doc = self._data.get(doc_id)
+            if doc is not None:
+                self._data.move_to_end(doc_id)
+            return doc
+
+    def put(self, doc_id: str, doc: Dict[str, Any], generation: int):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._data[doc_id] = doc
+            self._data.move_to_end(doc_id)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def invalidate(self, doc_ids: List[str]):
+        if not doc_ids: # 没有文档变化时不推进 generation，正在进行的读取仍可回填
+            return
+        with self._lock:
+            self.generation += 1
+            for doc_id in doc_ids:
+                self._data.pop(doc_id, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+
+
 class ProfileDB:
     """
     处理与用户画像（profile_info）相关的数据库操作 (SQLite)。
-    负责 profile_info 表和 platform_user_accounts 表的创建、读写等。
+    负责 profile_info 表、platform_user_accounts 表和 sobriquet_counts 表的创建、读写等。
     profile_info._id 是 NaturalPersonID。
     platform_user_accounts 存储用户在不同平台的账户信息。
     """
 
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, document_cache_size: int = _DOCUMENT_CACHE_SIZE):
         self.db_path = db_path
-        self._lock = threading.RLock() 
+        # 写操作共享一个连接，只在 self._lock 下访问，因此可跨线程使用；SQLite 本身同一时刻只允许一个写事务，
+        # 这里只需一把普通互斥锁（没有重入的调用路径），读操作不经过它
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        # 读操作使用独立的只读连接池：WAL 模式下读者与写者互不阻塞，读操作也不必等待 self._lock
+        self._idle_readers: "queue.SimpleQueue[sqlite3.Connection]" = queue.SimpleQueue()
+        self._reader_slots = threading.BoundedSemaphore(_READ_POOL_SIZE)
+        # 已解析文档的缓存；只有经由本实例的写操作会使其失效，document_cache_size=0 时不缓存
+        self._doc_cache = _DocumentCache(document_cache_size)
+        # 同步数据库操作在专用的有界线程池中执行，不与进程内其它 to_thread 调用争用默认执行器；
+        # 线程数 = 只读连接池大小 + 1 个写线程，足以让所有连接同时工作。首次使用时创建，close() 时关闭；
+        # 调用方的事件循环与 SobriquetManager 处理线程的循环都会提交任务，创建、提交与关闭都在 _executor_lock 下进行
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
         self._create_tables_if_not_exists() # 同步创建表
         logger.info(f"ProfileDB_SQLite 初始化成功，使用数据库文件: '{db_path}'")
 
-    def _get_connection_sync(self): # 同步获取连接的方法
-        conn = sqlite3.connect(self.db_path, timeout=10)
-        conn.row_factory = sqlite3.Row 
+    def _get_connection_sync(self): # 同步获取连接的方法，调用方需持有 self._lock
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False, cached_statements=_STATEMENT_CACHE_SIZE)
+            conn.row_factory = sqlite3.Row 
+            conn.executescript(_CONNECTION_PRAGMAS)
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _begin_immediate_sync(conn: sqlite3.Connection):
+        """
+        显式开启写事务。BEGIN IMMEDIATE 在事务开始时就取得写锁，先读后写的操作不会在中途升级写锁时遇到 SQLITE_BUSY；
+        事务内的多条语句由调用方最后一次 commit 提交。
+        """
+        conn.execute("BEGIN IMMEDIATE")
+
+    def _open_reader_sync(self) -> sqlite3.Connection:
+        uri = f"{Path(self.db_path).resolve().as_uri()}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, timeout=10, check_same_thread=False, cached_statements=_STATEMENT_CACHE_SIZE)
+        conn.row_factory = sqlite3.Row
+        conn.executescript(_CONNECTION_PRAGMAS)
         return conn
 
+    @contextlib.contextmanager
+    def _read_connection_sync(self):
+        """
+        取一条连接用于只读查询（同步）。文件数据库从只读连接池中获取，不持有 self._lock；
+        内存数据库无法被其它连接共享，退回到持锁使用共享连接。
+        """
+        if self.db_path == ":memory:":
+            with self._lock:
+                yield self._get_connection_sync()
+            return
+        with self._reader_slots:
+            try:
+                conn = self._idle_readers.get_nowait()
+            except queue.Empty:
+                conn = self._open_reader_sync()
+            try:
+                yield conn
+            finally:
+                self._idle_readers.put(conn)
+
+    async def _run_sync(self, func, *args):
+        """
+        在本实例的专用线程池中执行同步函数并等待结果。
+        提交在锁内完成，不会提交到已关闭的线程池；close() 之后的调用会新建线程池，由下一次 close() 关闭。
+        """
+        loop = asyncio.get_running_loop()
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=_READ_POOL_SIZE + 1, thread_name_prefix="profiledb")
+            future = loop.run_in_executor(self._executor, functools.partial(func, *args))
+        return await future
+
+    async def connect(self):
+        """显式建立共享连接（幂等）。各方法在首次访问时也会自动建立连接。"""
+        def _sync_connect():
+            with self._lock:
+                self._get_connection_sync()
+        await self._run_sync(_sync_connect)
+
+    def _close_sync(self):
+        self._doc_cache.clear()
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    # 关闭前按 SQLite 的建议执行 PRAGMA optimize，在需要时更新查询规划器的统计信息（只读连接无法写入统计表，不执行）
+                    self._conn.execute("PRAGMA optimize")
+                except sqlite3.Error as e:
+                    logger.warning(f"关闭连接前执行 PRAGMA optimize 失败: {e}")
+                self._conn.close()
+                self._conn = None
+        while True: # 关闭空闲的只读连接；之后的读操作会按需重新建立
+            try:
+                self._idle_readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+    async def close(self):
+        """
+        关闭共享连接、空闲的只读连接和专用线程池。
+        之后再次访问数据库时会重新建立连接和线程池（包括 SobriquetManager 处理线程中迟到的写入），需要再次调用 close() 释放。
+        """
+        await self._run_sync(self._close_sync)
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False) # 已提交的任务仍会执行完毕，之后空闲线程随之退出
+
     def _create_tables_if_not_exists(self): # 同步方法
         with self._lock:
             conn = self._get_connection_sync()
             try:
                 cursor = conn.cursor()
-                # 修改 profile_info 表，移除 platform_accounts 字段
-                cursor.execute("""
-                CREATE TABLE IF NOT EXISTS profile_info (
-                    _id TEXT PRIMARY KEY,
-                    person_info_pid_ref TEXT,
-                    -- platform_accounts TEXT, -- 已移除，改为关系存储
-                    identity TEXT, 
-                    personality TEXT, 
-                    sobriquets_by_group TEXT, 
-                    impression TEXT,
-                    relationship_metrics TEXT,
-                    creation_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    last_updated_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-                """)
-                
-                # 创建新的 platform_user_accounts 表
-                cursor.execute("""
-                CREATE TABLE IF NOT EXISTS platform_user_accounts (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    profile_document_id TEXT NOT NULL,
-                    platform_name TEXT NOT NULL,
-                    platform_user_id TEXT NOT NULL,
-                    FOREIGN KEY (profile_document_id) REFERENCES profile_info(_id) ON DELETE CASCADE,
-                    UNIQUE (profile_document_id, platform_name, platform_user_id) -- 确保唯一性
-                )
-                """)
-                conn.commit()
-                logger.info("表 'profile_info' (移除了 platform_accounts) 和 'platform_user_accounts' 已检查/创建。")
+                # WAL 模式下读者不会阻塞后台写线程（SobriquetManager），写者也不会阻塞读者
+                journal_mode = cursor.execute("PRAGMA journal_mode=WAL;").fetchone()[0]
+                if str(journal_mode).lower() != "wal":
+                    logger.warning(f"无法将数据库 '{self.db_path}' 切换到 WAL 模式，当前 journal_mode: {journal_mode}")
+
+                existing_tables = {row[0]: row[1] for row in cursor.execute(
+                    "SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name IN ('profile_info', 'sobriquet_counts')"
+                )}
+                conn.executescript(_SCHEMA_SQL) # 所有 CREATE ... IF NOT EXISTS 一次执行
+
+                # 旧数据库的迁移在一个事务内完成
+                old_profile_info_sql = existing_tables.get("profile_info")
+                migrate_profile_info = old_profile_info_sql is not None and "WITHOUT ROWID" not in old_profile_info_sql.upper()
+                migrate_sobriquets = "sobriquet_counts" not in existing_tables and old_profile_info_sql is not None
+                if migrate_profile_info or migrate_sobriquets:
+                    self._begin_immediate_sync(conn)
+                    if migrate_profile_info:
+                        # 旧数据库中的 rowid 表：复制到新结构后替换
+                        cursor.execute(_PROFILE_INFO_SCHEMA.format(table="profile_info_without_rowid"))
+                        cursor.execute(f"""
+                        INSERT OR IGNORE INTO profile_info_without_rowid ({_PROFILE_INFO_COLUMNS})
+                        SELECT {_PROFILE_INFO_COLUMNS} FROM profile_info WHERE _id IS NOT NULL
+                        """)
+                        cursor.execute("DROP TABLE profile_info")
+                        cursor.execute("ALTER TABLE profile_info_without_rowid RENAME TO profile_info")
+                        logger.info("已将表 'profile_info' 迁移为 WITHOUT ROWID 表。")
+                    if migrate_sobriquets:
+                        # 把 sobriquets_by_group 列中的计数迁移到新表，之后该列只保留空对象；同一群组内重复的绰号次数相加，
+                        # 非数值的次数按 0 处理
+                        cursor.execute("""
+                        INSERT INTO sobriquet_counts (profile_id, group_key, name, count)
+                        SELECT p._id, g.key, json_extract(s.value, '$.name'), CASE WHEN json_type(s.value, '$.count') IN ('integer', 'real') THEN CAST(json_extract(s.value, '$.count') AS INTEGER) ELSE 0 END
+                        FROM profile_info AS p, json_each(p.sobriquets_by_group) AS g, json_each(g.value, '$.sobriquets') AS s
+                        WHERE json_valid(p.sobriquets_by_group) AND json_type(p.sobriquets_by_group) = 'object'
+                          AND g.type = 'object' AND s.type = 'object' AND json_type(s.value, '$.name') = 'text'
+                        ON CONFLICT (profile_id, group_key, name) DO UPDATE SET count = count + excluded.count
+                        """)
+                        migrated = cursor.rowcount
+                        cursor.execute("UPDATE profile_info SET sobriquets_by_group = '{}' WHERE sobriquets_by_group IS NOT '{}'")
+                        if migrated > 0:
+                            logger.info(f"已将 {migrated} 条群组绰号计数从 sobriquets_by_group 迁移到 sobriquet_counts 表。")
+                    conn.commit()
+                if cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is None:
+                    # 数据库还没有任何统计信息时收集一次（受 analysis_limit 限制），之后由关闭时的 PRAGMA optimize 维护
+                    cursor.execute("ANALYZE")
+                    conn.commit()
+                logger.info("表 'profile_info' (移除了 platform_accounts)、'platform_user_accounts' 和 'sobriquet_counts' 已检查/创建。")
             except sqlite3.Error as e:
                 logger.error(f"创建表时发生 SQLite 错误: {e}", exc_info=True)
+                if conn.in_transaction:
+                    conn.rollback()
                 raise
-            finally:
-                conn.close()
 
     def is_available(self) -> bool:
         return True
@@ -86,154 +420,380 @@ class ProfileDB:
             return False
 
         def _sync_ensure_doc_and_account():
+            with self._lock:
+                conn = self._get_connection_sync()
+                changed_doc_ids = [profile_document_id] # 出错时保守地使该文档的缓存失效
+                try:
+                    self._begin_immediate_sync(conn)
+                    # 文档与平台账户均用 INSERT OR IGNORE 写入，不必先 SELECT 判断是否存在
+                    changed_doc_ids = self._ensure_documents_sync(
+                        conn.cursor(), [(profile_document_id, person_info_pid_ref, platform, platform_user_id)]
+                    )
+                    conn.commit()
+                    return True
+                except sqlite3.Error as e:
+                    logger.error(f"确保 profile_info 文档和平台账户时发生 SQLite 错误 (profile_id '{profile_document_id}'): {e}", exc_info=True)
+                    conn.rollback()
+                    return False
+                finally:
+                    self._doc_cache.invalidate(changed_doc_ids) # 没有任何变化时缓存的文档仍然有效
+        return await self._run_sync(_sync_ensure_doc_and_account)
+
+
+    async def ensure_and_get_profile_document(self,
+                                              profile_document_id: str,
+                                              person_info_pid_ref: Optional[str] = None,
+                                              platform: Optional[str] = None,
+                                              platform_user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        ensure_profile_document_exists 与 get_profile_document 的合并版本：在同一个写事务内确保文档和平台账户存在，
+        随即读回完整文档，只需一次线程切换；读回的文档同时放入文档缓存。
+
+        Returns:
+            Optional[Dict[str, Any]]: 完整文档；出错时返回 None。
+        """
+        if not profile_document_id:
+            logger.error("profile_document_id 为空，无法确保文档存在。")
+            return None
+
+        def _sync_ensure_and_get():
             with self._lock:
                 conn = self._get_connection_sync()
                 try:
+                    self._begin_immediate_sync(conn)
                     cursor = conn.cursor()
-                    # 1. 确保 profile_info 文档存在
-                    cursor.execute("SELECT _id FROM profile_info WHERE _id = ?", (profile_document_id,))
-                    existing_doc = cursor.fetchone()
+                    self._ensure_documents_sync(cursor, [(profile_document_id, person_info_pid_ref, platform, platform_user_id)])
+                    docs = self._fetch_documents_sync(cursor, [profile_document_id], parse_json=False)
+                    conn.commit()
+                except sqlite3.Error as e:
+                    logger.error(f"确保并获取 profile_info 文档时发生 SQLite 错误 (profile_id '{profile_document_id}'): {e}", exc_info=True)
+                    conn.rollback()
+                    return None
+                finally:
+                    self._doc_cache.invalidate([profile_document_id])
+                # 仍持有写锁，其它写操作无法在此之间修改该文档，可以直接回填缓存
+                doc = docs.get(profile_document_id)
+                if doc is None:
+                    return None
+                self._doc_cache.put(profile_document_id, doc, self._doc_cache.generation)
+            return self._project_document(profile_document_id, doc)
+        return await self._run_sync(_sync_ensure_and_get)
 
-                    if not existing_doc:
-                        initial_identity = json.dumps({}) 
-                        initial_personality = json.dumps({}) 
-                        initial_sobriquets_by_group = json.dumps({}) 
-                        initial_impression = json.dumps([]) 
-                        initial_relationship_metrics = json.dumps({})
+    def _ensure_documents_sync(self, cursor: sqlite3.Cursor,
+                               rows: List[Tuple[str, Optional[str], Optional[str], Optional[str]]]) -> List[str]:
+        """
+        在给定游标上批量确保文档和平台账户存在（同步，调用方负责加锁、连接管理和提交）。
+        每行为 (profile_document_id, person_info_pid_ref, platform, platform_user_id)，platform/platform_user_id 可为 None。
 
-                        cursor.execute("""
-                        INSERT INTO profile_info (
-                            _id, person_info_pid_ref, 
-                            identity, personality, 
-                            sobriquets_by_group, impression, relationship_metrics,
-                            creation_timestamp, last_updated_timestamp 
-                        )
-                        VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                        """, (
-                            profile_document_id, person_info_pid_ref,
-                            initial_identity, initial_personality,
-                            initial_sobriquets_by_group, initial_impression, initial_relationship_metrics,
-                        ))
-                        logger.debug(f"为 profile_document_id '{profile_document_id}' 创建了新的 profile_info 记录。")
-                    
-                    # 2. 如果提供了平台和用户ID，则添加到 platform_user_accounts 表
-                    if platform and platform_user_id:
-                        platform_user_id_str = str(platform_user_id)
-                        try:
-                            cursor.execute("""
-                            INSERT INTO platform_user_accounts (profile_document_id, platform_name, platform_user_id)
-                            VALUES (?, ?, ?)
-                            """, (profile_document_id, platform, platform_user_id_str))
-                            logger.debug(f"为 profile_document_id '{profile_document_id}' 在平台 '{platform}' 添加了 platform_user_id '{platform_user_id_str}'。")
-                        except sqlite3.IntegrityError: # 捕获 UNIQUE 约束冲突
-                            logger.debug(f"平台账户 ({profile_document_id}, {platform}, {platform_user_id_str}) 已存在，未重复添加。")
-                        # 更新 profile_info 的 last_updated_timestamp (因为关联数据发生变化)
-                        cursor.execute("""
-                        UPDATE profile_info 
-                        SET last_updated_timestamp = CURRENT_TIMESTAMP 
-                        WHERE _id = ?
-                        """, (profile_document_id,))
+        Returns:
+            List[str]: 新增了平台账户的文档 id。已存在的文档只有这些发生了变化（新建的文档此前不可能在缓存中）。
+        """
+        cursor.executemany(_INSERT_DOCUMENT_SQL, [(r[0], r[1], _EMPTY_OBJ, _EMPTY_OBJ, _EMPTY_OBJ, _EMPTY_ARR, _EMPTY_OBJ) for r in rows])
+        # 逐行插入账户以便用 rowcount 判断是否真的新增；账户已存在（最常见的情况）时不再执行时间戳 UPDATE
+        changed_doc_ids: Dict[str, None] = {}
+        for r in rows:
+            if r[2] and r[3]:
+                cursor.execute(_INSERT_ACCOUNT_SQL, (r[0], r[2], str(r[3])))
+                if cursor.rowcount > 0:
+                    changed_doc_ids[r[0]] = None
+        if changed_doc_ids:
+            # 关联的账户数据发生变化，更新对应文档的 last_updated_timestamp
+            cursor.executemany(_TOUCH_DOCUMENT_SQL, [(doc_id,) for doc_id in changed_doc_ids])
+        return list(changed_doc_ids)
 
+    async def ensure_profile_documents_exist_bulk(self, rows: List[Tuple[str, Optional[str], Optional[str], Optional[str]]]) -> bool:
+        """
+        批量版本的 ensure_profile_document_exists，在一个事务内处理所有行。
+        每行为 (profile_document_id, person_info_pid_ref, platform, platform_user_id)。
+        """
+        rows = [row for row in rows if row and row[0]]
+        if not rows:
+            return False
+
+        def _sync_ensure_bulk():
+            with self._lock:
+                conn = self._get_connection_sync()
+                changed_doc_ids = [row[0] for row in rows] # 出错时保守地使所有相关文档的缓存失效
+                try:
+                    self._begin_immediate_sync(conn)
+                    changed_doc_ids = self._ensure_documents_sync(conn.cursor(), rows)
                     conn.commit()
                     return True
                 except sqlite3.Error as e:
-                    logger.error(f"确保 profile_info 文档和平台账户时发生 SQLite 错误 (profile_id '{profile_document_id}'): {e}", exc_info=True)
+                    logger.error(f"批量确保 profile_info 文档和平台账户时发生 SQLite 错误 ({len(rows)} 行): {e}", exc_info=True)
                     conn.rollback()
                     return False
                 finally:
-                    conn.close()
-        return await asyncio.to_thread(_sync_ensure_doc_and_account)
+                    self._doc_cache.invalidate(changed_doc_ids)
+        return await self._run_sync(_sync_ensure_bulk)
+
+    def _fetch_documents_sync(self, cursor: sqlite3.Cursor, profile_document_ids: List[str],
+                              fields: Optional[List[str]] = None, parse_json: bool = True) -> Dict[str, Dict[str, Any]]:
+        """
+        在给定游标上批量读取并组装 profile_info 文档（同步，调用方负责加锁和连接管理）。
+        每批 id 只执行一次查询，平台账户与绰号计数由子查询随文档行一并取回，返回以 _id 为键的字典。
+        parse_json 为 False 时 JSON 列保留为 _RawJSON 原始值，由调用方按需解析。
+        """
+        # 1. 获取 profile_info 表的数据
+        if fields:
+            # 如果指定了 fields，只选择白名单中的 profile_info 列；_id 用于关联，总是选取。排序后同一投影对应同一条 SQL
+            columns_to_select = tuple(sorted({"_id", *(f for f in fields if f in _PROFILE_INFO_FIELDS)}))
+        else: # 获取所有字段
+            columns_to_select = ("*",)
+
+        # fields 为 None (即获取所有) 或 fields 中明确包含时才读取 platform_accounts / sobriquets_by_group
+        with_accounts = fields is None or "platform_accounts" in fields
+        with_sobriquets = fields is None or "sobriquets_by_group" in fields
+
+        docs: Dict[str, Dict[str, Any]] = {}
+        for start in range(0, len(profile_document_ids), _IN_QUERY_CHUNK_SIZE): # 分块查询，避免超出 SQLite 的绑定参数上限
+            chunk = profile_document_ids[start:start + _IN_QUERY_CHUNK_SIZE]
+            cursor.execute(_select_documents_sql(columns_to_select, len(chunk), with_accounts, with_sobriquets), chunk)
+            docs.update((row["_id"], dict(row)) for row in cursor.fetchall())
+        if not docs:
+            return {}
 
+        for doc in docs.values():
+            # 2. 重构 platform_accounts 数据 (如果需要)
+            if with_accounts:
+                platform_accounts_data: Dict[str, List[str]] = {}
+                # UNIQUE (profile_document_id, platform_name, platform_user_id) 已保证不会有重复账户，直接追加
+                for p_name, p_uid in _loads(doc.pop("_accounts")):
+                    platform_accounts_data.setdefault(p_name, []).append(p_uid)
+                doc["platform_accounts"] = platform_accounts_data
+
+            # 3. 由 sobriquet_counts 的行重建 sobriquets_by_group (如果需要)，结构与原 JSON 列相同
+            if with_sobriquets:
+                sobriquets_by_group: Dict[str, Dict[str, Any]] = {}
+                for group_key, name, count in _loads(doc.pop("_sobriquets")):
+                    sobriquets_by_group.setdefault(group_key, {"sobriquets": []})["sobriquets"].append({"name": name, "count": count})
+                doc["sobriquets_by_group"] = sobriquets_by_group
+
+        # 4. 解析其他 JSON 字段
+        for doc_id, doc in docs.items():
+            for field_name in _JSON_FIELD_NAMES:
+                if field_name in doc and doc[field_name] is not None: # 确保字段存在于doc中 (可能因projection被排除)
+                    if parse_json:
+                        doc[field_name] = self._parse_json_field(doc_id, field_name, doc[field_name])
+                    else:
+                        doc[field_name] = _RawJSON(doc[field_name])
+
+        # 5. 如果指定了 fields，只返回请求的字段 (包括可能已重构的 platform_accounts)
+        if fields:
+            for doc_id, doc in docs.items():
+                final_doc = {f_name: doc[f_name] for f_name in fields if f_name in doc}
+                # 确保 _id 总是存在 (如果最初未请求但内部添加了)
+                if "_id" not in final_doc:
+                    final_doc["_id"] = doc_id
+                docs[doc_id] = final_doc
+        return docs
+
+    @staticmethod
+    def _parse_json_field(doc_id: str, field_name: str, raw: Any) -> Any:
+        try:
+            return _loads(raw)
+        except (json.JSONDecodeError, UnicodeDecodeError): # 标准库 json 解析非 UTF-8 的 BLOB 时抛出 UnicodeDecodeError
+            logger.error(f"获取文档时解析字段 '{field_name}' JSON 失败 for id '{doc_id}'. 内容: {raw}")
+            return {} if field_name != "impression" else []
+
+    @staticmethod
+    def _select_existing_ids_sync(cursor: sqlite3.Cursor, profile_document_ids: List[str]) -> List[str]:
+        """返回给定 id 中在 profile_info 里存在的那些；分块查询，避免超出 SQLite 的绑定参数上限。"""
+        existing: List[str] = []
+        for start in range(0, len(profile_document_ids), _IN_QUERY_CHUNK_SIZE):
+            chunk = profile_document_ids[start:start + _IN_QUERY_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            cursor.execute(f"SELECT _id FROM profile_info WHERE _id IN ({placeholders})", chunk)
+            existing.extend(row[0] for row in cursor.fetchall())
+        return existing
+
+    @staticmethod
+    def _select_sobriquet_rows_sync(cursor: sqlite3.Cursor, profile_document_ids: List[str],
+                                    group_key: Optional[str] = None) -> List[Tuple[str, str, str, int]]:
+        """
+        读取给定文档（可限定群组）的 (profile_id, group_key, name, count) 行，按绰号首次出现的顺序排列。
+        """
+        rows: List[Tuple[str, str, str, int]] = []
+        group_filter = "AND group_key = ?" if group_key is not None else ""
+        group_params = (group_key,) if group_key is not None else ()
+        for start in range(0, len(profile_document_ids), _IN_QUERY_CHUNK_SIZE):
+            chunk = profile_document_ids[start:start + _IN_QUERY_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            cursor.execute(f"""
+            SELECT profile_id, group_key, name, count FROM sobriquet_counts
+            WHERE profile_id IN ({placeholders}) {group_filter} ORDER BY rowid
+            """, (*chunk, *group_params))
+            rows.extend(tuple(row) for row in cursor.fetchall())
+        return rows
+
+    def _get_cached_documents_sync(self, profile_document_ids: List[str],
+                                   fields: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        按 id 读取文档（同步）：先查文档缓存，未命中的完整文档一次批量读取并回填缓存，再按 fields 投影。
+        缓存中的 JSON 列保持为原始值，只在被投影选中时解析一次并写回缓存，只取一个字段时不会解析其它列。
+        返回的是深拷贝，调用方修改结果不会影响缓存。
+        """
+        docs: Dict[str, Dict[str, Any]] = {}
+        missing: List[str] = []
+        for doc_id in profile_document_ids:
+            cached = self._doc_cache.get(doc_id)
+            if cached is None:
+                missing.append(doc_id)
+            else:
+                docs[doc_id] = cached
+        if missing:
+            generation = self._doc_cache.generation # 在读取前记下，读取期间发生写入则不回填
+            with self._read_connection_sync() as conn:
+                fetched = self._fetch_documents_sync(conn.cursor(), missing, parse_json=False)
+            for doc_id, doc in fetched.items():
+                self._doc_cache.put(doc_id, doc, generation)
+                docs[doc_id] = doc
+
+        return {doc_id: self._project_document(doc_id, docs[doc_id], fields)
+                for doc_id in profile_document_ids if doc_id in docs}
+
+    def _project_document(self, doc_id: str, doc: Dict[str, Any], fields: Optional[List[str]] = None) -> Dict[str, Any]:
+        """按 fields 投影缓存中的文档，解析被选中的 _RawJSON 列并返回深拷贝。"""
+        if fields: # 与 _fetch_documents_sync 的投影规则一致：只保留存在的字段，_id 总是存在
+            projected = {f_name: doc[f_name] for f_name in fields if f_name in doc}
+            projected.setdefault("_id", doc_id)
+        else:
+            projected = dict(doc)
+        for field_name, value in projected.items():
+            if isinstance(value, _RawJSON):
+                # 写回缓存中的文档（只替换已有键的值），同一字段之后不再解析；并发时最多重复解析一次，结果相同
+                projected[field_name] = doc[field_name] = self._parse_json_field(doc_id, field_name, value.raw)
+        return copy.deepcopy(projected)
 
     async def get_profile_document(self, profile_document_id: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
         if not profile_document_id:
             return None
 
         def _sync_get_doc():
-            with self._lock:
-                conn = self._get_connection_sync()
+            try:
+                return self._get_cached_documents_sync([profile_document_id], fields).get(profile_document_id)
+            except sqlite3.Error as e:
+                logger.error(f"获取 profile_info 文档时 SQLite 错误 (id '{profile_document_id}'): {e}", exc_info=True)
+                return None
+        return await self._run_sync(_sync_get_doc)
+
+    async def get_profile_documents(self, profile_document_ids: List[str], fields: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        批量获取多个 profile_info 文档，在同一个连接上用 WHERE _id IN (...) 一次读取，
+        代替逐个调用 get_profile_document。
+
+        Args:
+            profile_document_ids: 要获取的 profile_document_id 列表。
+            fields: 与 get_profile_document 相同的可选字段投影。
+
+        Returns:
+            Dict[str, Dict[str, Any]]: 以 profile_document_id 为键的文档字典，不存在的文档不会出现在结果中。
+        """
+        ids = list(dict.fromkeys(doc_id for doc_id in profile_document_ids if doc_id)) # 去重并保持顺序
+        if not ids:
+            return {}
+
+        def _sync_get_docs():
+            try:
+                return self._get_cached_documents_sync(ids, fields)
+            except sqlite3.Error as e:
+                logger.error(f"批量获取 profile_info 文档时 SQLite 错误 (ids {ids}): {e}", exc_info=True)
+                return {}
+        return await self._run_sync(_sync_get_docs)
+
+    async def iter_profile_documents(self, batch_size: int = 1000) -> AsyncIterator[Dict[str, Any]]:
+        """
+        按 _id 顺序遍历所有 profile_info 文档（用于导出、统计等全表扫描）。
+        使用 WHERE _id > ? ORDER BY _id LIMIT ? 的键集分页，每批在一次线程池调用内读取并解析，
+        不绕过也不填充文档缓存，避免一次扫描挤掉缓存中的热点文档。
+        """
+        last_id = ""
+
+        def _sync_fetch_batch(after_id: str) -> List[Dict[str, Any]]:
+            with self._read_connection_sync() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT _id FROM profile_info WHERE _id > ? ORDER BY _id LIMIT ?", (after_id, batch_size))
+                ids = [row[0] for row in cursor.fetchall()]
+                if not ids:
+                    return []
+                docs = self._fetch_documents_sync(cursor, ids)
+                return [docs[doc_id] for doc_id in ids if doc_id in docs]
+
+        while True:
+            try:
+                batch = await self._run_sync(_sync_fetch_batch, last_id)
+            except sqlite3.Error as e:
+                logger.error(f"遍历 profile_info 文档时 SQLite 错误 (_id > '{last_id}'): {e}", exc_info=True)
+                return
+            if not batch:
+                return
+            for doc in batch:
+                yield doc
+            last_id = batch[-1]["_id"]
+
+    async def get_group_sobriquets(self, profile_document_ids: List[str], group_key: str) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        批量获取多个用户在指定群组 (group_key，如 "platform-group_id") 下的绰号列表。
+        只从 sobriquet_counts 表中读取对应群组的行，不读取其它群组的数据。
+
+        Returns:
+            Dict[str, List[Dict[str, Any]]]: 以 profile_document_id 为键的绰号列表；
+            文档存在但该群组无记录时为空列表，文档不存在时不出现在结果中。
+        """
+        ids = list(dict.fromkeys(doc_id for doc_id in profile_document_ids if doc_id))
+        if not ids or not group_key:
+            return {}
+
+        def _sync_get_group_sobriquets():
+            with self._read_connection_sync() as conn:
                 try:
                     cursor = conn.cursor()
-                    
-                    # 1. 获取 profile_info 表的数据
-                    # 确定要从 profile_info 表查询的字段
-                    profile_info_query_fields_str = "*"
-                    profile_info_fields_to_select = []
-                    
-                    # 获取 profile_info 表的所有列名
-                    cursor.execute(f"PRAGMA table_info(profile_info);")
-                    profile_info_all_db_cols = [row['name'] for row in cursor.fetchall()]
-
-                    if fields:
-                        # 如果指定了 fields，只选择那些存在于 profile_info 表中的字段
-                        profile_info_fields_to_select = [f for f in fields if f in profile_info_all_db_cols]
-                        if "_id" not in profile_info_fields_to_select:
-                             profile_info_fields_to_select.insert(0, "_id")
-                        if not profile_info_fields_to_select : # 如果过滤后为空，但可能需要 platform_accounts
-                            if "platform_accounts" in fields: # 如果只请求 platform_accounts
-                                profile_info_fields_to_select.append("_id") # 至少需要_id来关联
-                            else: # 如果请求的字段都不在 profile_info 且不含 platform_accounts
-                                 profile_info_fields_to_select = ["_id"] # 默认取 _id
-                        profile_info_query_fields_str = ", ".join(profile_info_fields_to_select)
-                    else: # 获取所有字段
-                        profile_info_fields_to_select = profile_info_all_db_cols
-                        profile_info_query_fields_str = "*"
-                    
-                    cursor.execute(f"SELECT {profile_info_query_fields_str} FROM profile_info WHERE _id = ?", (profile_document_id,))
-                    row = cursor.fetchone()
+                    result: Dict[str, List[Dict[str, Any]]] = {doc_id: [] for doc_id in self._select_existing_ids_sync(cursor, ids)}
+                    for doc_id, _group_key, name, count in self._select_sobriquet_rows_sync(cursor, list(result), group_key):
+                        result[doc_id].append({"name": name, "count": count})
+                    return result
+                except sqlite3.Error as e:
+                    logger.error(f"获取群组 '{group_key}' 绰号时 SQLite 错误 (ids {ids}): {e}", exc_info=True)
+                    return {}
+        return await self._run_sync(_sync_get_group_sobriquets)
 
-                    if not row:
-                        return None
+    async def get_group_sobriquet_counts(self, profile_document_ids: List[str], group_key: str) -> Dict[str, Dict[str, int]]:
+        """
+        批量获取多个用户在指定群组下的 {绰号: 次数} 映射，返回可直接按绰号查找的字典。
 
-                    doc = dict(row)
-                    
-                    # 2. 获取并重构 platform_accounts 数据 (如果需要)
-                    # 无论是否在 fields 中明确指定 "platform_accounts"，如果 fields 为 None (即获取所有)，则应包含它
-                    # 或者如果 fields 中明确包含 "platform_accounts"
-                    should_fetch_platform_accounts = (fields is None) or ("platform_accounts" in fields)
-
-                    if should_fetch_platform_accounts:
-                        cursor.execute("SELECT platform_name, platform_user_id FROM platform_user_accounts WHERE profile_document_id = ?", (profile_document_id,))
-                        accounts_rows = cursor.fetchall()
-                        platform_accounts_data: Dict[str, List[str]] = {}
-                        for acc_row in accounts_rows:
-                            p_name = acc_row["platform_name"]
-                            p_uid = acc_row["platform_user_id"]
-                            if p_name not in platform_accounts_data:
-                                platform_accounts_data[p_name] = []
-                            # 避免在列表中添加重复的 platform_user_id (尽管DB层面有UNIQUE约束)
-                            if p_uid not in platform_accounts_data[p_name]:
-                                platform_accounts_data[p_name].append(p_uid)
-                        doc["platform_accounts"] = platform_accounts_data
-
-                    # 3. 解析其他 JSON 字段
-                    json_field_names = ["identity", "personality", 
-                                        "sobriquets_by_group", "impression", "relationship_metrics"]
-                    for field_name in json_field_names:
-                        if field_name in doc and doc[field_name] is not None: # 确保字段存在于doc中 (可能因projection被排除)
-                            try:
-                                doc[field_name] = json.loads(doc[field_name])
-                            except json.JSONDecodeError:
-                                logger.error(f"获取文档时解析字段 '{field_name}' JSON 失败 for id '{profile_document_id}'. 内容: {doc[field_name]}")
-                                doc[field_name] = {} if field_name != "impression" else []
-                    
-                    # 4. 如果指定了 fields，只返回请求的字段 (包括可能已重构的 platform_accounts)
-                    if fields:
-                        final_doc = {}
-                        for f_name in fields:
-                            if f_name in doc:
-                                final_doc[f_name] = doc[f_name]
-                        # 确保 _id 总是存在 (如果最初未请求但内部添加了)
-                        if "_id" not in final_doc and "_id" in doc:
-                            final_doc["_id"] = doc["_id"]
-                        return final_doc
-                    return doc
+        Returns:
+            Dict[str, Dict[str, int]]: 以 profile_document_id 为键；在该群组没有绰号的文档不出现在结果中。
+        """
+        ids = list(dict.fromkeys(doc_id for doc_id in profile_document_ids if doc_id))
+        if not ids or not group_key:
+            return {}
+
+        def _sync_get_counts():
+            with self._read_connection_sync() as conn:
+                try:
+                    result: Dict[str, Dict[str, int]] = {}
+                    for doc_id, _group_key, name, count in self._select_sobriquet_rows_sync(conn.cursor(), ids, group_key):
+                        result.setdefault(doc_id, {})[name] = int(count or 0)
+                    return result
                 except sqlite3.Error as e:
-                    logger.error(f"获取 profile_info 文档时 SQLite 错误 (id '{profile_document_id}'): {e}", exc_info=True)
-                    return None
-                finally:
-                    conn.close()
-        return await asyncio.to_thread(_sync_get_doc)
+                    logger.error(f"获取群组 '{group_key}' 绰号计数时 SQLite 错误 (ids {ids}): {e}", exc_info=True)
+                    return {}
+        return await self._run_sync(_sync_get_counts)
+
+    async def get_sobriquet_count(self, profile_document_id: str, group_key: str, sobriquet_name: str) -> int:
+        """获取单个用户在指定群组下某个绰号的次数，不存在时返回 0。按主键只取出这一个数值，不读取整个文档。"""
+        if not profile_document_id or not group_key or not sobriquet_name:
+            return 0
+
+        def _sync_get_count():
+            with self._read_connection_sync() as conn:
+                try:
+                    row = conn.execute(_SELECT_SOBRIQUET_COUNT_SQL, (profile_document_id, group_key, sobriquet_name)).fetchone()
+                    return int(row[0] or 0) if row else 0
+                except sqlite3.Error as e:
+                    logger.error(f"获取绰号 '{sobriquet_name}' 在群组 '{group_key}' 的计数时 SQLite 错误 (id {profile_document_id}): {e}", exc_info=True)
+                    return 0
+        return await self._run_sync(_sync_get_count)
 
     async def update_profile_fields(self, profile_document_id: str, updates: Dict[str, Any]) -> bool:
         if not profile_document_id or not updates:
@@ -246,22 +806,19 @@ class ProfileDB:
                     cursor = conn.cursor()
                     set_clauses = []
                     values = []
-                    # platform_accounts 不再通过此方法更新
-                    valid_fields = ["person_info_pid_ref", "identity", "personality", 
-                                    "sobriquets_by_group", "impression", "relationship_metrics"]
-
+                    sobriquet_rows = None # 非 None 时整体替换该文档在 sobriquet_counts 表中的行
                     for field_name, field_value in updates.items():
-                        if field_name not in valid_fields:
+                        if field_name not in _UPDATABLE_FIELDS: # platform_accounts 不再通过此方法更新
                             logger.warning(f"尝试更新无效字段 '{field_name}' for id '{profile_document_id}'。已跳过。")
                             continue
+                        if field_name == "sobriquets_by_group":
+                            sobriquet_rows = self._sobriquet_rows_from_document(profile_document_id, field_value)
+                            continue
                         
                         set_clauses.append(f"{field_name} = ?")
-                        if isinstance(field_value, (dict, list)): 
-                            values.append(json.dumps(field_value))
-                        else:
-                            values.append(field_value)
+                        values.append(_dump_column_value(field_value))
                     
-                    if not set_clauses:
+                    if not set_clauses and sobriquet_rows is None:
                         logger.info(f"没有有效的字段需要更新 for id '{profile_document_id}'。")
                         return True # 或者 False，取决于期望行为
 
@@ -269,86 +826,240 @@ class ProfileDB:
                     sql = f"UPDATE profile_info SET {', '.join(set_clauses)} WHERE _id = ?"
                     values.append(profile_document_id)
                     
+                    self._begin_immediate_sync(conn)
                     cursor.execute(sql, tuple(values))
-                    conn.commit()
-                    
                     if cursor.rowcount == 0:
+                        conn.rollback()
                         logger.warning(f"更新 profile_fields 失败：未找到 profile_document_id '{profile_document_id}' 或数据未改变。")
                         return False
+                    if sobriquet_rows is not None:
+                        cursor.execute("DELETE FROM sobriquet_counts WHERE profile_id = ?", (profile_document_id,))
+                        cursor.executemany(_INSERT_SOBRIQUET_COUNT_SQL, sobriquet_rows)
+                    conn.commit()
                     return True
                 except sqlite3.Error as e:
                     logger.error(f"更新 profile_fields 时 SQLite 错误 (id '{profile_document_id}'): {e}", exc_info=True)
                     conn.rollback()
                     return False
                 finally:
-                    conn.close()
-        return await asyncio.to_thread(_sync_update_fields)
+                    self._doc_cache.invalidate([profile_document_id])
+        return await self._run_sync(_sync_update_fields)
+
+    @staticmethod
+    def _sobriquet_rows_from_document(profile_document_id: str, sobriquets_by_group: Any) -> List[Tuple[str, str, str, int]]:
+        """
+        把 sobriquets_by_group 结构 ({group_key: {"sobriquets": [{"name", "count"}]}}) 展开为 sobriquet_counts 表的行。
+        同一群组内重复出现的绰号合并为一行，次数相加（表以 (profile_id, group_key, name) 为主键）。
+        """
+        if not isinstance(sobriquets_by_group, dict):
+            logger.warning(f"sobriquets_by_group 不是字典 for id '{profile_document_id}'，按空处理。")
+            return []
+        counts: Dict[Tuple[str, str], int] = {} # 保持首次出现的顺序
+        for group_key, group_data in sobriquets_by_group.items():
+            items = group_data.get("sobriquets") if isinstance(group_data, dict) else None
+            if not isinstance(items, list):
+                continue
+            for item in items:
+                if isinstance(item, dict) and isinstance(item.get("name"), str):
+                    try:
+                        count = int(item.get("count") or 0)
+                    except (TypeError, ValueError):
+                        logger.warning(f"绰号 '{item['name']}' 的次数无效 ({item.get('count')!r}) for id '{profile_document_id}'，按 0 处理。")
+                        count = 0
+                    key = (str(group_key), item["name"])
+                    counts[key] = counts.get(key, 0) + count
+        return [(profile_document_id, group_key, name, count) for (group_key, name), count in counts.items()]
 
     async def update_profile_field(self, profile_document_id: str, field_name: str, field_value: Any) -> bool:
         # 确保 field_name 不是 platform_accounts
         if field_name == "platform_accounts":
             logger.error("platform_accounts 不能通过 update_profile_field 更新，请使用特定账户管理方法。")
             return False
-        return await self.update_profile_fields(profile_document_id, {field_name: field_value})
+        sql = _UPDATE_ONE_SQL.get(field_name)
+        if sql is None or not profile_document_id: # 无效字段和 sobriquets_by_group 交给通用路径处理
+            return await self.update_profile_fields(profile_document_id, {field_name: field_value})
+        value = _dump_column_value(field_value)
+
+        def _sync_update_one():
+            with self._lock:
+                conn = self._get_connection_sync()
+                try:
+                    self._begin_immediate_sync(conn)
+                    cursor = conn.execute(sql, (value, profile_document_id))
+                    conn.commit()
+                    if cursor.rowcount == 0:
+                        logger.warning(f"更新 profile_fields 失败：未找到 profile_document_id '{profile_document_id}' 或数据未改变。")
+                        return False
+                    return True
+                except sqlite3.Error as e:
+                    logger.error(f"更新字段 '{field_name}' 时 SQLite 错误 (id '{profile_document_id}'): {e}", exc_info=True)
+                    conn.rollback()
+                    return False
+                finally:
+                    self._doc_cache.invalidate([profile_document_id])
+        return await self._run_sync(_sync_update_one)
     
     async def get_profile_field(self, profile_document_id: str, field_name: str) -> Optional[Any]:
-        doc = await self.get_profile_document(profile_document_id, fields=[field_name])
-        return doc.get(field_name) if doc else None
+        """
+        读取单个字段。缓存命中时直接从缓存投影；未命中时 profile_info 的列只执行一条单列 SELECT，
+        不组装整个文档，也不回填缓存。platform_accounts / sobriquets_by_group 只读取对应的关联数据。
+        """
+        if not profile_document_id:
+            return None
+
+        def _sync_get_field():
+            cached = self._doc_cache.get(profile_document_id)
+            if cached is not None:
+                return self._project_document(profile_document_id, cached, [field_name]).get(field_name)
+            sql = _SELECT_ONE_SQL.get(field_name)
+            if sql is None and field_name not in ("platform_accounts", "sobriquets_by_group"):
+                return None # 不存在的字段
+            try:
+                with self._read_connection_sync() as conn:
+                    if sql is None:
+                        doc = self._fetch_documents_sync(conn.cursor(), [profile_document_id], fields=[field_name])
+                        return doc.get(profile_document_id, {}).get(field_name)
+                    row = conn.execute(sql, (profile_document_id,)).fetchone()
+            except sqlite3.Error as e:
+                logger.error(f"读取字段 '{field_name}' 时 SQLite 错误 (id '{profile_document_id}'): {e}", exc_info=True)
+                return None
+            if row is None or row[0] is None or field_name not in _JSON_FIELD_NAMES:
+                return row[0] if row is not None else None
+            return self._parse_json_field(profile_document_id, field_name, row[0])
+        return await self._run_sync(_sync_get_field)
 
     async def update_group_sobriquet_count(self, profile_document_id: str, platform: str, group_id_str: str, sobriquet_name: str) -> bool:
-        # 此方法逻辑不变，因为它操作的是 sobriquets_by_group 字段
+        """
+        把用户在指定群组下某个绰号的次数加 1（不存在则添加，次数为 1）。
+        计数存于 sobriquet_counts 表，加一是一条按主键的 UPSERT，不读取或改写整个 sobriquets_by_group。
+        """
         if not profile_document_id:
             logger.error("profile_document_id 为空，无法更新绰号计数。")
             return False
         group_key = f"{platform}-{group_id_str}"
+
         def _sync_update_sobriquet():
             with self._lock:
                 conn = self._get_connection_sync()
                 try:
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT sobriquets_by_group FROM profile_info WHERE _id = ?", (profile_document_id,))
-                    row = cursor.fetchone()
-                    if not row:
+                    self._begin_immediate_sync(conn)
+                    # 先更新时间戳：rowcount 同时说明文档是否存在，无需单独 SELECT，再用一条 UPSERT 加一
+                    cursor = conn.execute(_TOUCH_DOCUMENT_SQL, (profile_document_id,))
+                    if cursor.rowcount == 0:
+                        conn.rollback()
                         logger.error(f"更新绰号计数失败：未找到 profile_document_id '{profile_document_id}' 的记录。")
-                        return False 
-                    sobriquets_by_group_json_str = row["sobriquets_by_group"]
-                    sobriquets_by_group_data = {}
-                    if sobriquets_by_group_json_str:
-                        try: sobriquets_by_group_data = json.loads(sobriquets_by_group_json_str)
-                        except json.JSONDecodeError:
-                            logger.error(f"解析 sobriquets_by_group JSON 失败: {sobriquets_by_group_json_str}")
-                            sobriquets_by_group_data = {}
-                    if group_key not in sobriquets_by_group_data:
-                        sobriquets_by_group_data[group_key] = {"sobriquets": []}
-                    if not isinstance(sobriquets_by_group_data[group_key].get("sobriquets"), list):
-                        sobriquets_by_group_data[group_key]["sobriquets"] = []
-                    group_sobriquets_list = sobriquets_by_group_data[group_key]["sobriquets"]
-                    found_sobriquet = False
-                    for item in group_sobriquets_list:
-                        if isinstance(item, dict) and item.get("name") == sobriquet_name:
-                            item["count"] = item.get("count", 0) + 1
-                            found_sobriquet = True; break
-                    if not found_sobriquet:
-                        group_sobriquets_list.append({"name": sobriquet_name, "count": 1})
-                    updated_json_str = json.dumps(sobriquets_by_group_data)
-                    cursor.execute("UPDATE profile_info SET sobriquets_by_group = ?, last_updated_timestamp = CURRENT_TIMESTAMP WHERE _id = ?", 
-                                   (updated_json_str, profile_document_id))
+                        return False
+                    conn.execute(_UPSERT_SOBRIQUET_COUNT_SQL, (profile_document_id, group_key, sobriquet_name, 1))
                     conn.commit()
-                    logger.debug(f"为 profile_id '{profile_document_id}' 在群组 '{group_key}' 更新/添加绰号 '{sobriquet_name}'。")
+                    logger.debug("为 profile_id '%s' 在群组 '%s' 更新/添加绰号 '%s'。", profile_document_id, group_key, sobriquet_name)
                     return True
                 except sqlite3.Error as e:
-                    logger.error(f"更新群组绰号计数 SQLite 错误: {e}", exc_info=True); conn.rollback(); return False
-                except Exception as e_generic:
-                    logger.error(f"更新群组绰号计数一般错误: {e_generic}", exc_info=True); 
-                    if conn: conn.rollback(); 
+                    logger.error(f"更新群组绰号计数 SQLite 错误: {e}", exc_info=True)
+                    conn.rollback()
                     return False
-                finally: 
-                    if conn: conn.close()
-        return await asyncio.to_thread(_sync_update_sobriquet)
+                finally:
+                    self._doc_cache.invalidate([profile_document_id])
+        return await self._run_sync(_sync_update_sobriquet)
+
+    def _merge_sobriquet_counts_sync(self, cursor: sqlite3.Cursor, increments: List[Tuple[str, str, str, int]]) -> int:
+        """
+        在给定游标上把绰号计数增量写入 sobriquet_counts 表（同步，调用方负责加锁、事务和提交）。
+        每条增量为 (profile_document_id, group_key, sobriquet_name, delta)；同一绰号的增量先在内存中合并，
+        再用一次 executemany 的 UPSERT 写入。文档不存在的增量会被跳过。
+
+        Returns:
+            int: 实际应用的增量条数。
+        """
+        doc_ids = list(dict.fromkeys(inc[0] for inc in increments))
+        existing_doc_ids = set(self._select_existing_ids_sync(cursor, doc_ids))
+
+        deltas: Dict[Tuple[str, str, str], int] = {} # 保持首次出现的顺序，新绰号按该顺序插入
+        applied = 0
+        for doc_id, group_key, sobriquet_name, delta in increments:
+            if doc_id not in existing_doc_ids:
+                logger.error(f"更新绰号计数失败：未找到 profile_document_id '{doc_id}' 的记录。")
+                continue
+            key = (doc_id, group_key, sobriquet_name)
+            deltas[key] = deltas.get(key, 0) + delta
+            applied += 1
+
+        cursor.executemany(_UPSERT_SOBRIQUET_COUNT_SQL, [(*key, delta) for key, delta in deltas.items()])
+        cursor.executemany(_TOUCH_DOCUMENT_SQL, [(doc_id,) for doc_id in dict.fromkeys(key[0] for key in deltas)])
+        return applied
+
+    async def update_group_sobriquet_counts_bulk(self, events: List[Tuple[str, str, str, str]]) -> int:
+        """
+        批量版本的 update_group_sobriquet_count，在一个事务内把每条事件的绰号计数加 1。
+        每条事件为 (profile_document_id, platform, group_id_str, sobriquet_name)；文档不存在的事件会被跳过。
+
+        Returns:
+            int: 成功应用的事件条数；出错时回滚并返回 0。
+        """
+        increments = [(doc_id, f"{platform}-{group_id_str}", name, 1)
+                      for doc_id, platform, group_id_str, name in events if doc_id and name]
+        if not increments:
+            return 0
+
+        def _sync_update_bulk():
+            with self._lock:
+                conn = self._get_connection_sync()
+                try:
+                    self._begin_immediate_sync(conn)
+                    applied = self._merge_sobriquet_counts_sync(conn.cursor(), increments)
+                    conn.commit()
+                    logger.debug(f"批量更新 {applied}/{len(increments)} 条群组绰号计数。")
+                    return applied
+                except sqlite3.Error as e:
+                    logger.error(f"批量更新群组绰号计数时 SQLite 错误: {e}", exc_info=True)
+                    conn.rollback()
+                    return 0
+                finally:
+                    self._doc_cache.invalidate([inc[0] for inc in increments])
+        return await self._run_sync(_sync_update_bulk)
+
+    async def apply_sobriquet_writes(self, writes: List[Tuple[str, Optional[str], str, str, str, str, int]]) -> int:
+        """
+        在一个事务内批量写入绰号计数。每条记录为
+        (profile_document_id, person_info_pid_ref, platform, platform_user_id, group_id_str, sobriquet_name, delta)。
+        对每条记录确保 profile_info 文档与平台账户存在（等同 ensure_profile_document_exists），
+        再把同一文档的所有增量合并到 sobriquets_by_group 中，每个文档只读写一次。
+
+        Returns:
+            int: 成功写入的记录条数；出错时回滚并返回 0。
+        """
+        if not writes:
+            return 0
+
+        def _sync_apply_writes():
+            with self._lock:
+                conn = self._get_connection_sync()
+                try:
+                    self._begin_immediate_sync(conn)
+                    cursor = conn.cursor()
+                    self._ensure_documents_sync(cursor, [w[:4] for w in writes])
+                    applied = self._merge_sobriquet_counts_sync(
+                        cursor, [(w[0], f"{w[2]}-{w[4]}", w[5], w[6]) for w in writes]
+                    )
+                    conn.commit()
+                    logger.debug(f"批量写入 {applied} 条绰号记录。")
+                    return applied
+                except sqlite3.Error as e:
+                    logger.error(f"批量写入绰号记录时 SQLite 错误: {e}", exc_info=True)
+                    conn.rollback()
+                    return 0
+                finally:
+                    self._doc_cache.invalidate([w[0] for w in writes])
+        return await self._run_sync(_sync_apply_writes)
 
     async def get_profile_document_for_find_projection(self, profile_doc_id: str, projection: Optional[Dict] = None) -> Optional[Dict]:
+        if not profile_doc_id:
+            return None
+        # 字段计算、读取与投影整体在一次线程池调用内完成
+        return await self._run_sync(self._find_projection_sync, profile_doc_id, projection)
+
+    def _find_projection_sync(self, profile_doc_id: str, projection: Optional[Dict] = None) -> Optional[Dict]:
         # 此方法与 get_profile_document 类似，都需要处理 platform_accounts 的重构
-        # 简化：直接调用 get_profile_document，然后应用投影（如果需要更细致的投影，则需复制并调整逻辑）
+        # 先把投影解析为需要读取的字段列表，按字段读取后再应用投影
         
         # 确定投影是否请求了 platform_accounts 或其子内容，或者是否请求了所有内容
         requested_fields_for_get_doc = None
@@ -378,7 +1089,17 @@ class ProfileDB:
                  requested_fields_for_get_doc = ["_id"]
 
 
-        full_doc = await self.get_profile_document(profile_doc_id, fields=requested_fields_for_get_doc)
+        try:
+            if requested_fields_for_get_doc is None or self._doc_cache.get(profile_doc_id) is not None:
+                full_doc = self._get_cached_documents_sync([profile_doc_id], requested_fields_for_get_doc).get(profile_doc_id)
+            else:
+                # 有投影且缓存未命中：只 SELECT 投影需要的列（platform_accounts 等子查询也只在被请求时执行），
+                # 未请求的大 JSON 列（如 impression）不读取也不解析，结果不回填缓存
+                with self._read_connection_sync() as conn:
+                    full_doc = self._fetch_documents_sync(conn.cursor(), [profile_doc_id], requested_fields_for_get_doc).get(profile_doc_id)
+        except sqlite3.Error as e:
+            logger.error(f"获取 profile_info 文档时 SQLite 错误 (id '{profile_doc_id}'): {e}", exc_info=True)
+            return None
 
         if not full_doc:
             return None
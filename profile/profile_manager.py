@@ -1,6 +1,7 @@
 # profile/profile_manager.py
 import hashlib
 import asyncio 
+import functools
 from typing import List, Dict, Any, Optional
 
 from stubs.mock_config import global_config
@@ -19,6 +20,8 @@ class ProfileManager:
             self.db_handler: ProfileDB = ProfileDB(self.db_path) 
 
         self.profile_id_salt = global_config.security.profile_id_salt
+        # person_info_pid -> profile_document_id 的有界缓存，盐值在实例生命周期内不变
+        self._cached_profile_doc_id = functools.lru_cache(maxsize=4096)(self._hash_profile_document_id)
         if self.profile_id_salt == "default_salt_please_change_me" or self.profile_id_salt == "test_salt_for_profile_id":
             logger.warning(f"安全警告：正在使用测试/默认的 profile_id_salt ('{self.profile_id_salt}')。请在生产配置中设置一个强盐值！")
         
@@ -39,9 +42,11 @@ class ProfileManager:
         if not person_info_pid:
             logger.error("生成 profile_document_id 时，person_info_pid 为空。")
             raise ValueError("person_info_pid cannot be empty for ID generation.")
+        return self._cached_profile_doc_id(person_info_pid)
+
+    def _hash_profile_document_id(self, person_info_pid: str) -> str:
         salted_input = f"{self.profile_id_salt}-{person_info_pid}"
-        hashed_id = hashlib.sha256(salted_input.encode('utf-8')).hexdigest()
-        return hashed_id
+        return hashlib.sha256(salted_input.encode('utf-8')).hexdigest()
 
     async def get_users_group_sobriquets_for_prompt_injection_data(
         self, platform: str, platform_user_ids: List[str], group_id: str
@@ -85,24 +90,10 @@ class ProfileManager:
         group_key_in_db = f"{platform}-{group_id_str}"
 
         try:
-            projection_for_find = {
-                "_id": 1,
-                f"sobriquets_by_group.{group_key_in_db}.sobriquets": 1 
-            }
-            
-            for profile_doc_id_to_query in profile_doc_ids_to_query:
-                profile_doc = await self.db_handler.get_profile_document_for_find_projection(
-                    profile_doc_id_to_query,
-                    projection=projection_for_find
-                )
-                if not profile_doc:
-                    continue
-
-                profile_document_id_from_doc = profile_doc.get("_id")
-                group_data_container = profile_doc.get("sobriquets_by_group", {})
-                group_data = group_data_container.get(group_key_in_db) if group_key_in_db in group_data_container else group_data_container
-                raw_sobriquets_list = group_data.get("sobriquets", []) if isinstance(group_data, dict) else []
+            # 批量取回所有用户在该群组下的绰号列表（只按 group_key 读取 sobriquet_counts 表中对应群组的行）
+            sobriquets_by_doc_id = await self.db_handler.get_group_sobriquets(profile_doc_ids_to_query, group_key_in_db)
 
+            for profile_document_id_from_doc, raw_sobriquets_list in sobriquets_by_doc_id.items():
                 if not raw_sobriquets_list: continue
                 formatted_sobriquets = []
                 for item in raw_sobriquets_list:
@@ -154,8 +145,14 @@ class ProfileManager:
             except Exception as e:
                 logger.error(f"获取 platform_nicknames_map 时出错: {e}", exc_info=True)
 
+        # 当前群组在 sobriquets_by_group 中的键，对所有用户相同，循环外只构建一次
+        group_key = f"{current_platform}-{current_group_id}" if current_group_id else None
+
+        # 一次 IN 查询取回上下文中所有用户的画像文档，避免逐个查询
+        profile_docs = await self.db_handler.get_profile_documents(natural_person_ids_in_context)
+
         for npid in natural_person_ids_in_context:
-            profile_doc = await self.db_handler.get_profile_document(npid)
+            profile_doc = profile_docs.get(npid)
             if not profile_doc:
                 logger.warning(f"未能为 NaturalPersonID '{npid}' 获取画像文档。")
                 prompt_data[npid] = {} 
@@ -173,7 +170,6 @@ class ProfileManager:
                 
                 if current_group_id:
                     sobriquets_by_group = profile_doc.get("sobriquets_by_group", {})
-                    group_key = f"{current_platform}-{current_group_id}"
                     group_sobriquets_info = sobriquets_by_group.get(group_key, {}).get("sobriquets", [])
                     if group_sobriquets_info and isinstance(group_sobriquets_info, list):
                         # 按次数排序，取最常用的作为群昵称
@@ -194,7 +190,6 @@ class ProfileManager:
             current_group_sobriquets_list = []
             if current_group_id: # 只有在群聊上下文中才提取
                 sobriquets_by_group_data = profile_doc.get("sobriquets_by_group", {})
-                group_key = f"{current_platform}-{current_group_id}"
                 current_group_info = sobriquets_by_group_data.get(group_key, {}).get("sobriquets", [])
                 if isinstance(current_group_info, list):
                     # 按使用次数排序，取前几个（例如前3个）
@@ -0,0 +1,68 @@
+# profile/sobriquet/llm_cache.py
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+# 从 stubs 导入
+from stubs.mock_dependencies import get_logger
+
+logger = get_logger("LLMCache")
+
+
+class MemoryBackend:
+    """进程内的 LRU 存储，超过 max_entries 时淘汰最久未使用的条目。"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+
+class LLMCache:
+    """
+    LLM 响应的精确匹配缓存。
+    只缓存确定性的调用（temperature 为 0），相同的模型、消息和工具定义直接返回上次的响应。
+    """
+
+    def __init__(self, backend: Optional[MemoryBackend] = None):
+        self.backend = backend or MemoryBackend()
+
+    @staticmethod
+    def cache_key(model: str, messages: List[Any], temperature: float, tools: Optional[List[Any]] = None) -> Optional[str]:
+        """生成缓存键；temperature > 0 时响应不确定，返回 None 表示不缓存。"""
+        if temperature is None or temperature > 0:
+            return None
+        payload = json.dumps(
+            {"model": model, "messages": messages, "temperature": temperature, "tools": tools or []},
+            ensure_ascii=False, sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: Optional[str]) -> Optional[Any]:
+        if key is None:
+            return None
+        value = self.backend.get(key)
+        if value is not None:
+            logger.debug(f"LLM 缓存命中: {key[:12]}...")
+        return value
+
+    def set(self, key: Optional[str], value: Any):
+        if key is None or value is None:
+            return
+        self.backend.set(key, value)
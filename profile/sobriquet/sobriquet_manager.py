@@ -1,10 +1,12 @@
 # profile/sobriquet/sobriquet_manager.py
 import asyncio
+import logging
 import threading
 import random
 import time
 import json
 import re
+from dataclasses import dataclass
 from typing import Dict, Optional, List, Any, Callable, Tuple # 确保 Tuple 被导入
 
 from stubs.mock_config import global_config
@@ -28,6 +30,7 @@ from profile.profile_db import ProfileDB
 # 导入更新后的 sobriquet_mapper 和 sobriquet_utils
 from .sobriquet_mapper import build_mapping_prompt
 from .sobriquet_utils import select_sobriquets_for_prompt, format_sobriquet_prompt_injection, weighted_sample_without_replacement
+from .llm_cache import LLMCache, MemoryBackend
 
 logger = get_logger("SobriquetManager")
 logger_helper = get_logger("AsyncLoopHelper") 
@@ -36,9 +39,9 @@ logger_helper = get_logger("AsyncLoopHelper")
 def run_async_loop(loop: asyncio.AbstractEventLoop, coro):
     asyncio.set_event_loop(loop)
     try:
-        logger_helper.debug(f"Running coroutine in loop {id(loop)}...")
+        logger_helper.debug("Running coroutine in loop %d...", id(loop))
         result = loop.run_until_complete(coro)
-        logger_helper.debug(f"Coroutine completed in loop {id(loop)}.")
+        logger_helper.debug("Coroutine completed in loop %d.", id(loop))
         return result
     except asyncio.CancelledError:
         logger_helper.info(f"Coroutine in loop {id(loop)} was cancelled.")
@@ -59,7 +62,7 @@ def run_async_loop(loop: asyncio.AbstractEventLoop, coro):
 
             if hasattr(loop, 'shutdown_asyncgens'):
                  loop.run_until_complete(loop.shutdown_asyncgens())
-                 logger_helper.debug(f"Async generators shutdown in loop {id(loop)}.")
+                 logger_helper.debug("Async generators shutdown in loop %d.", id(loop))
 
             if loop.is_running():
                 loop.stop()
@@ -72,6 +75,42 @@ def run_async_loop(loop: asyncio.AbstractEventLoop, coro):
 # --- run_async_loop 定义结束 ---
 
 
+# 处理循环每次最多合并多少个已就绪的队列项目，其产生的绰号写入在同一个事务中提交
+_WRITE_BATCH_MAX = 64
+
+
+@dataclass
+class SobriquetWriteRequest:
+    """一条待写入的绰号计数更新，由 LLM 分析结果产生，交给 ProfileDB.apply_sobriquet_writes 批量提交。"""
+    doc_id: str
+    person_info_pid: str
+    platform: str
+    platform_user_id: str
+    group_id: str
+    name: str
+    delta: int = 1
+
+
+class _DrainMarker:
+    """
+    排空标记：由 SobriquetManager.drain() 放入队列。
+    处理循环按 FIFO 顺序取到它时，说明它之前入队的项目都已处理完毕，
+    此时通过 call_soon_threadsafe 唤醒调用方事件循环中等待的 future。
+    """
+    __slots__ = ("future", "loop")
+
+    def __init__(self, future: asyncio.Future, loop: asyncio.AbstractEventLoop):
+        self.future = future
+        self.loop = loop
+
+    def resolve(self, drained: bool = True):
+        def _set_result():
+            if not self.future.done(): # 调用方可能已超时取消
+                self.future.set_result(drained)
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(_set_result)
+
+
 class SobriquetManager:
     _instance = None
     _lock = threading.Lock()
@@ -109,6 +148,8 @@ class SobriquetManager:
             
             # LLM 映射器使用模拟函数
             self.llm_mapper_fn = mock_llm_generate_response 
+            # 确定性（temperature=0）映射调用的精确匹配缓存，重复的 prompt 不再调用 LLM
+            self.llm_cache = LLMCache(MemoryBackend(max_entries=global_config.profile.sobriquet_llm_cache_size))
             if self.is_enabled:
                 model_config_obj = global_config.model.get("sobriquet_mapping") 
                 if model_config_obj and model_config_obj.get("name"): 
@@ -118,12 +159,16 @@ class SobriquetManager:
                     self.is_enabled = False
             
             self.chat_history_provider = chat_history_provider if chat_history_provider is not None else {}
-            logger.debug(f"SobriquetManager initialized with chat_history_provider (id: {id(self.chat_history_provider)}), keys: {list(self.chat_history_provider.keys())}")
+            if logger.isEnabledFor(logging.DEBUG): # 列出所有聊天流的键是 O(N) 的，非 DEBUG 时跳过
+                logger.debug(f"SobriquetManager initialized with chat_history_provider (id: {id(self.chat_history_provider)}), keys: {list(self.chat_history_provider.keys())}")
 
             self.queue_max_size = global_config.profile.sobriquet_queue_max_size
             self.sobriquet_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_max_size)
             self._stop_event = threading.Event()
             self._sobriquet_thread: Optional[threading.Thread] = None
+            self._processor_loop: Optional[asyncio.AbstractEventLoop] = None # 处理器线程内的事件循环
+            self._pending_count = 0 # 已入队但写入尚未提交的分析项目数（跨线程更新，由 _pending_lock 保护）
+            self._pending_lock = threading.Lock()
             self.sleep_interval = global_config.profile.sobriquet_process_sleep_interval
             self._initialized = True
             logger.info(f"SobriquetManager 初始化完成。当前启用状态: {self.is_enabled}")
@@ -152,9 +197,12 @@ class SobriquetManager:
             self._stop_event.set()
             try: 
                 # 尝试向队列放入一个 None 来唤醒等待的 get()
-                self.sobriquet_queue.put_nowait(None) # 使用 put_nowait 避免阻塞
-            except asyncio.QueueFull: 
-                logger.debug("停止处理器时队列已满，项目将在处理后停止。")
+                # 队列属于处理器线程的事件循环，需通过 call_soon_threadsafe 投递才能立即唤醒
+                loop = self._processor_loop
+                if loop is not None and loop.is_running():
+                    loop.call_soon_threadsafe(self._put_stop_signal_nowait)
+                else:
+                    self._put_stop_signal_nowait()
             except Exception as e: # 更通用的异常捕获
                 logger.warning(f"停止处理器时向队列发送 None 失败: {e}")
 
@@ -172,18 +220,100 @@ class SobriquetManager:
         else: 
             logger.info("绰号处理器线程未在运行或已被清理。")
 
+    def _put_stop_signal_nowait(self):
+        try:
+            self.sobriquet_queue.put_nowait(None) # 使用 put_nowait 避免阻塞
+        except asyncio.QueueFull: 
+            logger.debug("停止处理器时队列已满，项目将在处理后停止。")
+
+    async def _put_threadsafe(self, item: Any):
+        """
+        将项目放入绰号队列。队列由处理器线程的事件循环消费，
+        从其他事件循环调用时通过 run_coroutine_threadsafe 投递，保证处理器被立即唤醒且顺序不变。
+        """
+        loop = self._processor_loop
+        if loop is not None and loop.is_running() and loop is not asyncio.get_running_loop():
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self.sobriquet_queue.put(item), loop))
+        else:
+            await self.sobriquet_queue.put(item)
+
+    def _enqueue_nowait(self, item: tuple, platform: str, group_id: str):
+        """在处理器事件循环中放入分析项目；队列已满时丢弃该项目并回退待处理计数。"""
+        try:
+            self.sobriquet_queue.put_nowait(item)
+            logger.debug("项目已添加至 %s-%s 绰号队列。大小: %d", platform, group_id, self.sobriquet_queue.qsize())
+        except asyncio.QueueFull: 
+            self._adjust_pending(-1)
+            logger.warning(f"绰号队列已满 (最大={self.queue_max_size})。{platform}-{group_id} 项目被丢弃。")
+
     async def _add_to_queue(self, item: tuple, platform: str, group_id: str):
+        """
+        投递分析项目后立即返回，不等待处理器事件循环完成入队，调用方可以继续处理后续消息。
+        投递顺序与调用顺序一致，之后调用的 drain() 仍会排在该项目之后。
+        """
         try:
             if self._stop_event.is_set() and item is not None: # 检查停止事件
                  logger.info(f"停止事件已设置，不再添加新项目到队列: {platform}-{group_id}")
                  return
-            await self.sobriquet_queue.put(item)
-            logger.debug(f"项目已添加至 {platform}-{group_id} 绰号队列。大小: {self.sobriquet_queue.qsize()}")
-        except asyncio.QueueFull: 
-            logger.warning(f"绰号队列已满 (最大={self.queue_max_size})。{platform}-{group_id} 项目被丢弃。")
+            self._adjust_pending(1)
+            try:
+                loop = self._processor_loop
+                if loop is not None and loop.is_running() and loop is not asyncio.get_running_loop():
+                    loop.call_soon_threadsafe(self._enqueue_nowait, item, platform, group_id)
+                else:
+                    self._enqueue_nowait(item, platform, group_id)
+            except BaseException:
+                self._adjust_pending(-1)
+                raise
         except Exception as e: 
             logger.error(f"添加项目到绰号队列出错: {e}", exc_info=True)
 
+    async def drain(self) -> bool:
+        """
+        等待调用前已入队的所有绰号分析项目处理完毕（包括数据库写入）。
+
+        Returns:
+            bool: 队列已排空返回 True；处理器未运行时立即返回 False。
+        """
+        if not self._sobriquet_thread or not self._sobriquet_thread.is_alive() or self._stop_event.is_set():
+            logger.debug("绰号处理器未运行，drain() 直接返回。")
+            return False
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        await self._put_threadsafe(_DrainMarker(future, loop))
+        return await future
+
+    def is_idle(self) -> bool:
+        """所有已入队的分析项目都已处理完毕（包括数据库写入）。"""
+        return self._pending_count == 0
+
+    def _adjust_pending(self, delta: int):
+        if delta:
+            with self._pending_lock:
+                self._pending_count += delta
+
+    async def wait_until_idle(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待处理器空闲（所有已入队的分析项目都已处理并提交写入）。
+        通过 drain() 等待此前入队的项目处理完毕；若期间又有新项目入队，则继续等待。
+
+        Returns:
+            bool: 处理器已空闲返回 True；处理器未运行或超时返回 False。
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while not self.is_idle():
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            try:
+                if not await asyncio.wait_for(self.drain(), timeout=remaining):
+                    return False
+            except asyncio.TimeoutError:
+                logger.warning(f"等待绰号处理器空闲超时 ({timeout}s)。")
+                return False
+        return True
+
     async def trigger_sobriquet_analysis(
         self, anchor_message: MockMessageRecv, bot_reply: List[str], chat_stream: Optional[MockChatStream] = None
     ):
@@ -362,7 +492,7 @@ class SobriquetManager:
             # 5. 调用 format_sobriquet_prompt_injection 进行格式化
             injection_str = format_sobriquet_prompt_injection(users_formatted_for_injection, is_group_chat=True)
             
-            if injection_str: 
+            if injection_str and logger.isEnabledFor(logging.DEBUG): 
                 logger.debug(f"{log_prefix} 生成绰号注入 (部分):\n{injection_str.strip()[:200]}...")
             return injection_str
             
@@ -370,24 +500,26 @@ class SobriquetManager:
             logger.error(f"{log_prefix} 获取绰号注入时出错: {e}", exc_info=True)
             return ""
 
-    async def _analyze_and_update_sobriquets(self, item: tuple):
+    async def _analyze_sobriquets(self, item: tuple) -> List[SobriquetWriteRequest]:
+        """分析一个队列项目，返回需要写入的绰号更新（不直接写库，由处理循环批量提交）。"""
         if not isinstance(item, tuple) or len(item) != 5: # 确保 item 结构正确
             logger.warning(f"从队列接收到无效项目: {type(item)} 内容: {item}")
-            return
+            return []
 
         chat_history_str, bot_reply, platform, group_id_str, user_name_map = item
         log_prefix = f"[{platform}:{group_id_str}]"
 
         if not self.llm_mapper_fn: 
             logger.error(f"{log_prefix} LLM 映射函数 (模拟) 不可用。")
-            return
+            return []
         if not self.db_handler or not self.db_handler.is_available(): 
             logger.error(f"{log_prefix} ProfileDB (SQLite) 不可用。")
-            return
+            return []
 
         # 调用 LLM 进行分析，现在传入 user_name_map
         analysis_result = await self._call_llm_for_analysis(chat_history_str, bot_reply, user_name_map)
 
+        writes: List[SobriquetWriteRequest] = []
         if analysis_result.get("is_exist") and analysis_result.get("data"):
             sobriquet_map_to_update = analysis_result["data"]
             logger.info(f"{log_prefix} LLM (模拟) 找到绰号映射，准备更新: {sobriquet_map_to_update}")
@@ -397,6 +529,7 @@ class SobriquetManager:
                     logger.warning(f"{log_prefix} 跳过无效条目: platform_uid='{platform_user_id_str}', sobriquet='{sobriquet_name}'")
                     continue
                 
+                person_info_pid = None
                 try:
                     # 使用模拟的 person_info_manager 获取 person_info_pid
                     person_info_pid = mock_person_info_manager.get_person_id(platform, platform_user_id_str)
@@ -406,25 +539,31 @@ class SobriquetManager:
                     
                     # 使用 ProfileManager 生成 profile_document_id
                     profile_doc_id = self.profile_manager.generate_profile_document_id(person_info_pid)
-                    
-                    # 确保文档存在
-                    await self.db_handler.ensure_profile_document_exists(
-                        profile_doc_id, person_info_pid, platform, platform_user_id_str
-                    )
-                    
-                    # 更新绰号计数
-                    await self.db_handler.update_group_sobriquet_count(
-                        profile_doc_id, platform, group_id_str, sobriquet_name
-                    )
-                    
-                    logger.debug(f"{log_prefix} 已为 profile_doc_id '{profile_doc_id}' (uid '{platform_user_id_str}') 更新/添加绰号 '{sobriquet_name}' @ grp '{group_id_str}'。")
-
+                    writes.append(SobriquetWriteRequest(
+                        profile_doc_id, person_info_pid, platform, platform_user_id_str, group_id_str, sobriquet_name
+                    ))
                 except ValueError as ve: 
-                     logger.error(f"{log_prefix} 生成 profile_doc_id 失败: {ve} for uid: {platform_user_id_str}, pipid: {person_info_pid if 'person_info_pid' in locals() else 'N/A'}")
+                     logger.error(f"{log_prefix} 生成 profile_doc_id 失败: {ve} for uid: {platform_user_id_str}, pipid: {person_info_pid or 'N/A'}")
                 except Exception as e: 
                     logger.exception(f"{log_prefix} 处理用户 {platform_user_id_str} 绰号 '{sobriquet_name}' 时意外错误：{e}")
         else:
             logger.debug(f"{log_prefix} LLM (模拟) 未找到可靠绰号映射或分析失败。")
+        return writes
+
+    async def _flush_sobriquet_writes(self, writes: List[SobriquetWriteRequest]):
+        """在一个事务中提交累积的绰号写入，提交后清空列表。"""
+        if not writes:
+            return
+        applied = await self.db_handler.apply_sobriquet_writes(
+            [(w.doc_id, w.person_info_pid, w.platform, w.platform_user_id, w.group_id, w.name, w.delta) for w in writes]
+        )
+        if applied:
+            for w in writes: # 逐条日志使用惰性格式化，DEBUG 关闭时不拼接字符串
+                logger.debug("[%s:%s] 已为 profile_doc_id '%s' (uid '%s') 更新/添加绰号 '%s' @ grp '%s'。",
+                             w.platform, w.group_id, w.doc_id, w.platform_user_id, w.name, w.group_id)
+        else:
+            logger.error(f"批量写入 {len(writes)} 条绰号记录失败。")
+        writes.clear()
 
     async def _call_llm_for_analysis( self, chat_history_str: str, bot_reply: str, user_name_map: Dict[str, str]) -> Dict[str, Any]:
         """
@@ -436,11 +575,19 @@ class SobriquetManager:
         
         # 构建 prompt 时传入 user_name_map
         prompt = build_mapping_prompt(chat_history_str, bot_reply, user_name_map) 
-        logger.debug(f"构建的绰号映射 Prompt (部分):\n{prompt[:300]}...") # 调整日志输出长度
+        if logger.isEnabledFor(logging.DEBUG): # 每次分析都会经过，非 DEBUG 时跳过切片与格式化
+            logger.debug(f"构建的绰号映射 Prompt (部分):\n{prompt[:300]}...") # 调整日志输出长度
 
         try:
-            # 使用模拟的 LLM 函数
-            response_content, _, _ = self.llm_mapper_fn(prompt, context_user_id=None) # 模拟函数可能需要 context_user_id
+            model_config_obj = global_config.model.get("sobriquet_mapping")
+            cache_key = LLMCache.cache_key(
+                model_config_obj.get("name") if model_config_obj else "", [prompt],
+                model_config_obj.get("temp") if model_config_obj else None
+            )
+            response_content = self.llm_cache.get(cache_key)
+            if response_content is None:
+                # 使用模拟的 LLM 函数
+                response_content, _, _ = self.llm_mapper_fn(prompt, context_user_id=None) # 模拟函数可能需要 context_user_id
             
             if not response_content: 
                 logger.warning("LLM (模拟) 返回空绰号映射内容。"); return {"is_exist": False}
@@ -461,7 +608,8 @@ class SobriquetManager:
                     logger.warning(f"LLM (模拟) 响应不含有效JSON。响应(首200): {stripped_content[:200]}")
                     return {"is_exist": False}
             
-            logger.debug(f"将要解析的 JSON 字符串 (repr): {repr(json_str)}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"将要解析的 JSON 字符串 (repr): {repr(json_str)}")
             
             try:
                 result = json.loads(json_str)
@@ -478,6 +626,8 @@ class SobriquetManager:
             if is_exist:
                 data = result.get("data")
                 if isinstance(data, dict) and data:
+                    # 只缓存解析成功且含有效映射的响应；失败或回退的 is_exist=False 结果不缓存，避免一次偶发失败被反复重放
+                    self.llm_cache.set(cache_key, response_content)
                     # 调用 _filter_llm_results 进行过滤
                     filtered = self._filter_llm_results(data, user_name_map) 
                     if not filtered: 
@@ -513,18 +663,18 @@ class SobriquetManager:
             # 过滤机器人自己的绰号
             if bot_qq and uid == bot_qq and \
                ("(你)" in user_display_name_in_map or user_display_name_in_map == global_config.bot.nickname):
-                logger.debug(f"过滤机器人自己的绰号映射: uid='{uid}', s_name='{s_name}'")
+                logger.debug("过滤机器人自己的绰号映射: uid='%s', s_name='%s'", uid, s_name)
                 continue
             
             # 过滤空或仅含空白的绰号
             if not s_name or s_name.isspace(): 
-                logger.debug(f"过滤用户 {uid} 的空绰号。")
+                logger.debug("过滤用户 %s 的空绰号。", uid)
                 continue
             
             cleaned_s = s_name.strip()
             # 过滤长度不符合要求的绰号
             if not (min_l <= len(cleaned_s) <= max_l): 
-                logger.debug(f"过滤绰号'{cleaned_s}' for uid '{uid}':长度({len(cleaned_s)})不符。范围: [{min_l}-{max_l}]")
+                logger.debug("过滤绰号'%s' for uid '%s':长度(%d)不符。范围: [%d-%d]", cleaned_s, uid, len(cleaned_s), min_l, max_l)
                 continue
             
             filtered[uid] = cleaned_s
@@ -536,43 +686,110 @@ class SobriquetManager:
         loop = None 
         try:
             loop = asyncio.new_event_loop()
+            self._processor_loop = loop
             run_async_loop(loop, self._processing_loop()) 
         except Exception as e: 
             logger.error(f"绰号处理器线程(ID:{tid})顶层错误: {e}", exc_info=True)
         finally: 
+            self._processor_loop = None
             logger.info(f"绰号处理器线程结束 (ID: {tid}).")
 
+    async def _analyze_segment(self, segment: List[tuple], pending_writes: List[SobriquetWriteRequest]) -> int:
+        """
+        并发分析一段互不依赖的项目，按入队顺序把写入追加到 pending_writes，返回分析的项目数并清空 segment。
+        同一文档的前置写入（文档/账号的确保）在 apply_sobriquet_writes 中按批去重，分析之间不需要互相等待。
+        """
+        if not segment:
+            return 0
+        # return_exceptions=True：单个项目分析出错只丢弃该项目，不影响同段其它项目的写入
+        results = await asyncio.gather(*(self._analyze_sobriquets(item) for item in segment), return_exceptions=True)
+        for item, writes in zip(segment, results):
+            if isinstance(writes, BaseException):
+                prefix = f"[{item[2]}:{item[3]}]" if isinstance(item, tuple) and len(item) == 5 else ""
+                logger.error(f"{prefix} 分析绰号项目时意外错误，已跳过该项目: {writes}", exc_info=writes)
+                continue
+            pending_writes.extend(writes)
+        count = len(segment)
+        segment.clear()
+        return count
+
     async def _processing_loop(self): 
         logger.info("绰号异步处理循环已启动。")
         while not self._stop_event.is_set():
             try:
                 item = await asyncio.wait_for(self.sobriquet_queue.get(), timeout=self.sleep_interval)
-                if item is None: # 收到 None 表示需要停止
-                    logger.info("处理循环收到 None item, 准备退出。")
-                    self.sobriquet_queue.task_done()
-                    break 
-                
-                if self._stop_event.is_set(): # 再次检查停止事件
-                    logger.info("处理循环在获取项目后检测到停止事件，退出。")
-                    self.sobriquet_queue.task_done()
-                    break
-                
-                await self._analyze_and_update_sobriquets(item)
-                self.sobriquet_queue.task_done()
             except asyncio.TimeoutError: 
                 continue # 超时是正常的，继续下一次循环
             except asyncio.CancelledError: 
                 logger.info("绰号处理循环被取消。")
                 break
+
+            # 连同已就绪的后续项目一起处理（最多 _WRITE_BATCH_MAX 个），写入合并为一个事务
+            batch = [item]
+            while len(batch) < _WRITE_BATCH_MAX:
+                try:
+                    batch.append(self.sobriquet_queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+
+            pending_writes: List[SobriquetWriteRequest] = []
+            should_stop = False
+            # 分析项目的写入提交后才从待处理计数中扣除
+            batch_work = sum(1 for it in batch if it is not None and not isinstance(it, _DrainMarker))
+            analyzed_since_flush = 0
+            settled = 0
+            segment: List[tuple] = [] # 两个屏障（drain 标记 / 停止信号）之间的分析项目，彼此没有依赖
+            try:
+                for item in batch:
+                    if should_stop: # 停止信号之后的项目不再处理，仅标记完成
+                        if isinstance(item, _DrainMarker):
+                            item.resolve(False)
+                    elif item is None: # 收到 None 表示需要停止
+                        logger.info("处理循环收到 None item, 准备退出。")
+                        analyzed_since_flush += await self._analyze_segment(segment, pending_writes)
+                        await self._flush_sobriquet_writes(pending_writes)
+                        should_stop = True
+                    elif isinstance(item, _DrainMarker): # 此前入队的项目均已处理完毕，先提交它们的写入
+                        analyzed_since_flush += await self._analyze_segment(segment, pending_writes)
+                        await self._flush_sobriquet_writes(pending_writes)
+                        self._adjust_pending(-analyzed_since_flush)
+                        settled += analyzed_since_flush
+                        analyzed_since_flush = 0
+                        item.resolve()
+                    elif self._stop_event.is_set(): # 再次检查停止事件
+                        logger.info("处理循环在获取项目后检测到停止事件，退出。")
+                        analyzed_since_flush += await self._analyze_segment(segment, pending_writes)
+                        await self._flush_sobriquet_writes(pending_writes)
+                        should_stop = True
+                    else:
+                        segment.append(item)
+                analyzed_since_flush += await self._analyze_segment(segment, pending_writes)
+                await self._flush_sobriquet_writes(pending_writes)
+            except asyncio.CancelledError: 
+                logger.info("绰号处理循环被取消。")
+                should_stop = True
             except Exception as e:
                 logger.error(f"绰号处理循环处理项目时出错: {e}", exc_info=True)
+                for pending in batch: # 本批中尚未处理到的 drain() 调用方不应一直挂起（已完成的 future 不受影响）
+                    if isinstance(pending, _DrainMarker):
+                        pending.resolve(False)
                 if not self._stop_event.is_set(): # 如果不是因为停止事件引发的错误
                     await asyncio.sleep(global_config.profile.error_sleep_interval) # 出错后休眠
+            finally:
+                self._adjust_pending(settled - batch_work)
+                for _ in batch:
+                    self.sobriquet_queue.task_done()
+            if should_stop:
+                break
         
         # 清理队列中剩余的项目 (如果循环是因为 stop_event 而不是 None item 退出)
         while not self.sobriquet_queue.empty():
             try:
                 item = self.sobriquet_queue.get_nowait()
+                if isinstance(item, _DrainMarker): # 不让等待 drain() 的调用方一直挂起
+                    item.resolve(False)
+                elif item is not None:
+                    self._adjust_pending(-1)
                 logger.info(f"处理循环结束，丢弃队列中剩余项目: {item is not None}")
                 self.sobriquet_queue.task_done()
             except asyncio.QueueEmpty: 
@@ -14,6 +14,7 @@ class ProfileConfig:
         self.error_sleep_interval = 5 # 出错时的休眠间隔
         self.sobriquet_min_length = 1
         self.sobriquet_max_length = 15
+        self.sobriquet_llm_cache_size = 256 # 绰号映射 LLM 响应缓存的最大条目数
         self.profile_info_collection_name = "profile_info" # 在SQLite中这将是表名
         self.db_path = "profile.db" # SQLite数据库文件路径
 
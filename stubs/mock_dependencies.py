@@ -1,12 +1,25 @@
 # stubs/mock_dependencies.py
 # 模拟项目中的其他依赖
 
+import json
 import logging
 import time
-from typing import List, Dict, Any, Optional, Callable, Awaitable, Tuple 
+from typing import List, Dict, Any, Optional, Callable, Awaitable, Tuple, Union 
 
 from stubs.mock_config import global_config # 确保 global_config 被导入
 
+try:
+    import orjson # 可选：C 实现的 JSON 序列化，缺失时回退到标准库 json
+except ImportError:
+    orjson = None
+
+def dumps_json(obj: Any, indent: bool = False) -> str:
+    """序列化为 JSON 字符串（保留非 ASCII 字符）。安装了 orjson 时使用 orjson。"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, option=option).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None)
+
 # --- 模拟 Logger ---
 def get_logger(name):
     logger = logging.getLogger(name)
@@ -27,7 +40,7 @@ class MockDbCollection:
         self.logger = get_logger(f"MockDbCollection({collection_name})")
 
     async def find(self, query: Dict, projection: Optional[Dict] = None) -> List[Dict]:
-        self.logger.debug(f"Mock find called with query: {query}, projection: {projection}")
+        self.logger.debug("Mock find called with query: %s, projection: %s", query, projection)
         # 模拟基于 ProfileDB 的 find
         if "_id" in query and "$in" in query["_id"]:
             ids_to_find = query["_id"]["$in"]
@@ -60,12 +73,13 @@ class MockPersonInfoManager:
 
     def get_person_id(self, platform: str, user_id: str) -> Optional[str]:
         pid = self.user_to_pid_map.get((platform, str(user_id)))
-        self.logger.debug(f"get_person_id({platform}, {user_id}) -> {pid}")
+        self.logger.debug("get_person_id(%s, %s) -> %s", platform, user_id, pid)
         return pid
 
-    def add_mock_user(self, platform: str, user_id: str, person_info_pid: str):
+    def add_mock_user(self, platform: str, user_id: str, person_info_pid: str) -> str:
         self.user_to_pid_map[(platform, str(user_id))] = person_info_pid
         self.logger.info(f"Added mock user: ({platform}, {user_id}) -> {person_info_pid}")
+        return person_info_pid
 
 person_info_manager = MockPersonInfoManager()
 
@@ -91,7 +105,7 @@ class MockRelationshipManager:
             name = self.user_to_name_map.get((platform, str(user_id_str)))
             if name:
                 results[str(user_id_str)] = name
-        self.logger.debug(f"get_person_names_batch({platform}, {user_ids}) -> {results}")
+        self.logger.debug("get_person_names_batch(%s, %s) -> %s", platform, user_ids, results)
         return results
     
     def add_mock_user_name(self, platform: str, user_id: str, name: str):
@@ -128,7 +142,7 @@ class MockRelationshipManager:
                         "user_id": uid_str,
                         "sobriquets": formatted_sobriquets 
                     }
-        self.logger.debug(f"Mock get_users_group_sobriquets for {group_key}, users {user_ids} -> {results_by_actual_name}")
+        self.logger.debug("Mock get_users_group_sobriquets for %s, users %s -> %s", group_key, user_ids, results_by_actual_name)
         return results_by_actual_name
 
     def add_mock_group_sobriquet(self, platform: str, group_id: str, user_id: str, sobriquet_name: str, count: int = 1):
@@ -151,14 +165,16 @@ class MockRelationshipManager:
 relationship_manager = MockRelationshipManager()
 
 # --- 模拟 LLMRequest 和 LLM 调用 ---
-MOCK_LLM_RESPONSES: Dict[str, str] = {} 
+# 值可以是 dict（原样保存，命中时才序列化）或已序列化好的 JSON 字符串
+MOCK_LLM_RESPONSES: Dict[str, Union[Dict[str, Any], str]] = {} 
 
 def mock_llm_generate_response(prompt: str, context_user_id: Optional[str] = None) -> tuple[Optional[str], Optional[str], Optional[str]]:
     logger_llm = get_logger("mock_llm_generate_response")
-    logger_llm.debug(f"Mock LLM called with prompt (first 100 chars): {prompt[:100]}...")
+    logger_llm.debug("Mock LLM called with prompt (first 100 chars): %.100s...", prompt)
     for identifier_key in reversed(list(MOCK_LLM_RESPONSES.keys())):
         if identifier_key in prompt: 
-            response_json_str = MOCK_LLM_RESPONSES[identifier_key]
+            response = MOCK_LLM_RESPONSES[identifier_key]
+            response_json_str = response if isinstance(response, str) else dumps_json(response)
             logger_llm.info(f"Found mock response for key '{identifier_key}' in prompt.")
             return response_json_str, "mock_model_name_from_identifier", "mock_finish_reason_identifier_match"
     default_response = """
@@ -169,8 +185,9 @@ def mock_llm_generate_response(prompt: str, context_user_id: Optional[str] = Non
     logger_llm.info("No specific mock response found (based on identifier in prompt), returning default (is_exist: false).")
     return default_response, "mock_model_name_default", "mock_finish_reason_default"
 
-def set_mock_llm_response(identifier: str, response_json_string: str):
-    MOCK_LLM_RESPONSES[identifier] = response_json_string
+def set_mock_llm_response(identifier: str, response: Union[Dict[str, Any], str]):
+    """设置模拟 LLM 响应。response 可直接传入 dict，只有在被 prompt 命中时才序列化为 JSON 字符串。"""
+    MOCK_LLM_RESPONSES[identifier] = response
     get_logger("set_mock_llm_response").info(f"Set mock LLM response for identifier '{identifier}'.")
 
 # --- 模拟 ChatStream 和 MessageRecv ---
@@ -192,13 +209,18 @@ class MockChatStream:
         self.group_info = MockGroupInfo(group_id) if group_id else None 
         self.messages: List[Dict[str, Any]] = [] 
         self.recent_speakers_list: List[Dict[str, Any]] = [] 
+        self._next_timestamp: Optional[float] = None # add_messages 下一条消息的时间戳
         self.logger = get_logger(f"MockChatStream({self.stream_id})")
 
     def add_message(self, user_id: str, text: str, timestamp: Optional[float] = None, 
                     user_nickname: Optional[str] = None, 
                     user_cardname: Optional[str] = None,
-                    user_titlename: Optional[str] = None): 
-        msg_timestamp = timestamp if timestamp is not None else time.time()
+                    user_titlename: Optional[str] = None) -> Dict[str, Any]: 
+        msg_timestamp = timestamp
+        if msg_timestamp is None: # 未指定时保证晚于本流上一条消息，调用方无需 sleep 来区分先后
+            msg_timestamp = time.time()
+            if self.messages and msg_timestamp <= self.messages[-1]["time"]:
+                msg_timestamp = self.messages[-1]["time"] + 1e-6
         current_user_id_str = str(user_id) 
         name_from_rel_mgr = relationship_manager.user_to_name_map.get((self.platform, current_user_id_str))
         user_info_data = {
@@ -224,7 +246,23 @@ class MockChatStream:
         limit_recent_speakers = global_config.profile.recent_speakers_limit_for_injection 
         if len(self.recent_speakers_list) > limit_recent_speakers:
             self.recent_speakers_list = self.recent_speakers_list[:limit_recent_speakers]
-        self.logger.debug(f"Message added by user_id {current_user_id_str}. Total messages: {len(self.messages)}")
+        self.logger.debug("Message added by user_id %s. Total messages: %d", current_user_id_str, len(self.messages))
+        return msg
+
+    def add_messages(self, messages: List[Tuple[str, str]], start_timestamp: Optional[float] = None,
+                     interval: float = 1.0) -> List[Dict[str, Any]]:
+        """
+        批量添加 (user_id, text) 消息，按 interval 依次递增分配时间戳，保证消息顺序。
+        未指定 start_timestamp 时接着本流上一批消息的时间戳继续（首次为当前时间）。
+        """
+        ts = start_timestamp if start_timestamp is not None else (
+            self._next_timestamp if self._next_timestamp is not None else time.time())
+        added: List[Dict[str, Any]] = []
+        for user_id, text in messages:
+            added.append(self.add_message(user_id, text, timestamp=ts))
+            ts += interval
+        self._next_timestamp = ts
+        return added
 
     def get_recent_speakers(self, limit: int = 5) -> List[Dict[str, Any]]:
         return self.recent_speakers_list[:limit]
@@ -240,6 +278,13 @@ class MockMessageRecv:
         self.processed_plain_text = text 
         self.time = time.time() 
 
+    def bind(self, text: str) -> "MockMessageRecv":
+        """复用同一对象承载新消息：更新文本与时间戳后返回自身。"""
+        self.text = text
+        self.processed_plain_text = text
+        self.time = time.time()
+        return self
+
 # --- 模拟聊天记录获取 ---
 def get_raw_msg_before_timestamp_with_chat(
     chat_id: str, timestamp: float, limit: int, chat_streams_history: Dict[str, MockChatStream]
@@ -251,7 +296,7 @@ def get_raw_msg_before_timestamp_with_chat(
         relevant_messages.sort(key=lambda x: x["time"]) 
         if limit > 0 and len(relevant_messages) > limit:
             relevant_messages = relevant_messages[-limit:] 
-        logger_grh.debug(f"Found {len(relevant_messages)} messages for stream {chat_id} before {timestamp}. Returning up to {limit} (latest among them).")
+        logger_grh.debug("Found %d messages for stream %s before %s. Returning up to %s (latest among them).", len(relevant_messages), chat_id, timestamp, limit)
         return relevant_messages
     logger_grh.warning(f"Stream {chat_id} not found in chat_streams_history for history lookup.")
     return []